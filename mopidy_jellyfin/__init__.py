@@ -39,11 +39,36 @@ class Extension(ext.Extension):
         schema['album_format'] = config.String(optional=True)
         schema['max_bitrate'] = config.Integer(optional=True)
         schema['watched_status'] = config.Boolean(optional=True)
+        schema['cache_ttl'] = config.Integer(optional=True, minimum=0)
+        schema['cache_sizes'] = config.List(optional=True)
+        schema['cache_persist_ttl'] = config.Integer(optional=True, minimum=0)
+        schema['cache_max_stale'] = config.Integer(optional=True, minimum=0)
+        schema['local_search'] = config.Boolean(optional=True)
+        schema['library_sync'] = config.Boolean(optional=True)
+        schema['sync_interval'] = config.Integer(optional=True, minimum=0)
+        schema['page_size'] = config.Integer(optional=True, minimum=1)
+        schema['page_read_ahead'] = config.Integer(optional=True, minimum=0)
+        schema['connect_timeout'] = config.Integer(optional=True, minimum=1)
+        schema['read_timeout'] = config.Integer(optional=True, minimum=1)
+        schema['request_deadline'] = config.Integer(optional=True, minimum=0)
+        schema['pool_size'] = config.Integer(optional=True, minimum=1)
+        schema['keep_alive'] = config.Boolean(optional=True)
+        schema['request_concurrency'] = config.Integer(
+            optional=True, minimum=1)
+        schema['playlist_cache_size'] = config.Integer(
+            optional=True, minimum=1)
+        schema['image_max_width'] = config.Integer(optional=True, minimum=1)
+        schema['image_quality'] = config.Integer(
+            optional=True, minimum=1, maximum=100)
+        schema['image_proxy'] = config.Boolean(optional=True)
+        schema['image_cache_size'] = config.Integer(optional=True, minimum=0)
 
         return schema
 
     def setup(self, registry):
         from .backend import JellyfinBackend
         from .frontend import EventMonitorFrontend
+        from .images import factory
         registry.add('backend', JellyfinBackend)
         registry.add('frontend', EventMonitorFrontend)
+        registry.add('http:app', {'name': self.ext_name, 'factory': factory})
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 import logging
+import threading
 
 from mopidy import backend
 
@@ -10,6 +11,9 @@ from mopidy_jellyfin.library import JellyfinLibraryProvider
 from mopidy_jellyfin.playback import JellyfinPlaybackProvider
 from mopidy_jellyfin.remote import JellyfinHandler
 from mopidy_jellyfin.playlists import JellyfinPlaylistsProvider
+from mopidy_jellyfin.search import SearchIndex
+from mopidy_jellyfin.sync import LibrarySync
+from mopidy_jellyfin.utils import log_cache_stats
 
 
 logger = logging.getLogger(__name__)
@@ -21,7 +25,74 @@ class JellyfinBackend(pykka.ThreadingActor, backend.Backend):
     def __init__(self, config, audio):
         super(JellyfinBackend, self).__init__()
 
+        self.config = config
         self.library = JellyfinLibraryProvider(backend=self)
         self.playback = JellyfinPlaybackProvider(audio=audio, backend=self)
         self.remote = JellyfinHandler(config)
         self.playlists = JellyfinPlaylistsProvider(backend=self)
+
+        jellyfin = config['jellyfin']
+        self.search_index = None
+        if jellyfin.get('local_search'):
+            self.search_index = SearchIndex()
+
+        self.library_sync = None
+        self._stopped = threading.Event()
+
+    def on_start(self):
+        # Connecting can take a while, don't hold up Mopidy's startup
+        thread = threading.Thread(target=self._connect, name='JellyfinConnect')
+        thread.daemon = True
+        thread.start()
+
+    def on_stop(self):
+        self._stopped.set()
+        if self.library_sync is not None:
+            self.library_sync.stop()
+        log_cache_stats()
+
+    def sync_library(self):
+        # Catches the library mirror up with server side changes now
+        if self.library_sync is not None:
+            self.library_sync.trigger()
+
+    def _connect(self):
+        # Keep trying until the server is reachable, then load everything
+        # that needs it
+        delay = 1
+        while not self._stopped.is_set():
+            try:
+                self.remote.connect()
+                break
+            except Exception as e:
+                logger.warning(
+                    f'Jellyfin: Unable to connect, retrying in {delay} '
+                    f'seconds: {e}')
+                self._stopped.wait(delay)
+                delay = min(delay * 2, 60)
+        else:
+            return
+
+        logger.info('Jellyfin: Connected to the server')
+        self._start_sync()
+        try:
+            self.playlists.load()
+        except Exception as e:
+            logger.warning(f'Jellyfin: Failed to load playlists: {e}')
+
+    def _start_sync(self):
+        # Searches and lookups go to the server until the mirror is ready
+        jellyfin = self.config['jellyfin']
+
+        # The search index is filled from the library mirror
+        if jellyfin.get('library_sync') or self.search_index is not None:
+            interval = jellyfin.get('sync_interval')
+            self.library_sync = LibrarySync(
+                self.remote,
+                interval=900 if interval is None else interval,
+                index=self.search_index,
+                store=self.remote.store
+            )
+            if jellyfin.get('library_sync'):
+                self.remote.library_sync = self.library_sync
+            self.library_sync.start()
@@ -5,7 +5,9 @@ import threading
 import os
 import time
 
+from .backend import JellyfinBackend
 from .ws_client import WSClient
+from .utils import invalidate_items
 from mopidy_jellyfin import Extension
 
 logger = logging.getLogger(__name__)
@@ -21,32 +23,58 @@ class EventMonitorFrontend(
         super(EventMonitorFrontend, self).__init__()
         self.core = core
         self.config = config
-        self.token = self.config['jellyfin'].get('token') or self._read_token(config)
+        self.token = None
         self.hostname = self.config['jellyfin'].get('hostname')
         self.hostname = self.hostname.strip('/')
 
-        self.wsc = WSClient(self)
-        response_url = self.wsc.http.check_redirect(self.hostname)
-        if self.hostname != response_url:
-            self.hostname = response_url
+        # Created once the backend has logged in
+        self.wsc = None
+        self._stopped = threading.Event()
         self.reporting_thread = threading.Thread(target=self._check_status)
         # Kill thread immediately on program exit
         self.reporting_thread.daemon = True
 
     def on_start(self):
-        # Start the websocket client and reporting thread
-        self.wsc.start()
-        self.reporting_thread.start()
+        # Start the websocket client and reporting thread once connected
+        thread = threading.Thread(target=self._connect)
+        thread.daemon = True
+        thread.start()
 
     def on_stop(self):
         # Stop the websocket client and tell the server playback has stopped
-        self._stop_playback()
-        self.wsc.stop_client()
+        self._stopped.set()
+        if self.wsc is not None:
+            self._stop_playback()
+            self.wsc.stop_client()
+
+    def _connect(self):
+        # The backend logs in and writes the token, wait for it to be done
+        remote = None
+        while not self._stopped.is_set():
+            if remote is None:
+                remote = self._backend_remote()
+            if remote is not None and remote.ready.wait(5):
+                break
+            self._stopped.wait(1)
+        else:
+            return
+
+        self.token = self.config['jellyfin'].get('token') or self._read_token(
+            self.config)
+        self.hostname = remote.hostname
+
+        self.wsc = WSClient(self)
+        self.wsc.start()
+        self.reporting_thread.start()
 
     def on_event(self, event, **kwargs):
         # Receives internal Mopidy events
         super(EventMonitorFrontend, self).on_event(event, **kwargs)
 
+        if self.wsc is None:
+            # Not connected to the server yet
+            return
+
         if event == 'playback_state_changed':
             self._playback_state_changed(kwargs)
         elif event == 'seeked':
@@ -254,6 +282,48 @@ class EventMonitorFrontend(
             self.core.playback.seek(int(start_position))
 
 
+    def library_changed(self, data):
+        # Drops cached data for items the server reports as changed
+        added = data.get('ItemsAdded', [])
+        removed = data.get('ItemsRemoved', [])
+        updated = data.get('ItemsUpdated', [])
+        folders = (data.get('FoldersAddedTo', []) +
+                   data.get('FoldersRemovedFrom', []))
+
+        # Listings and searches hold the names of the items in them, so
+        # they're dropped for updates as well
+        invalidate_items(
+            added + removed + updated + folders,
+            aggregate=bool(added or removed or updated)
+        )
+        for playlists in self._backend_playlists():
+            playlists.invalidate(updated, removed, added)
+        # The library mirror would otherwise hand out the old items until
+        # its next scheduled sync
+        for ref in pykka.ActorRegistry.get_by_class(JellyfinBackend):
+            ref.proxy().sync_library()
+
+    def user_data_changed(self, data):
+        # Favorites and play counts live in the cached item data
+        user_data = data.get('UserDataList', [])
+
+        invalidate_items([i.get('ItemId') for i in user_data])
+        for playlists in self._backend_playlists():
+            playlists.user_data_changed(user_data)
+
+    def _backend_remote(self):
+        # Server connection of the running Jellyfin backend
+        refs = pykka.ActorRegistry.get_by_class(JellyfinBackend)
+        if refs:
+            return refs[0].proxy().remote.get()
+
+    def _backend_playlists(self):
+        # Playlist providers of the running Jellyfin backends
+        return [
+            ref.proxy().playlists
+            for ref in pykka.ActorRegistry.get_by_class(JellyfinBackend)
+        ]
+
     def _read_token(self, config):
         # Reads authentication token generated by backend
         cache_dir = Extension.get_cache_dir(config)
@@ -1,12 +1,274 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
 from mopidy import httpclient
 import requests
 import mopidy_jellyfin
+from mopidy_jellyfin.utils import bind_refresh
+import asyncio
+import datetime
+import functools
 import logging
+import random
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Clients shared by the backend, frontend and websocket client, keyed by
+# server and client certificate
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(config):
+    '''
+    Returns the JellyfinHttpClient for the server in the config, creating
+    it on first use.  Everything talking to the same server goes through
+    one connection pool and resolves the server address only once.
+
+    :param config: Mopidy config
+    :type config: dict
+    :returns: Shared client
+    :rtype: JellyfinHttpClient
+    '''
+    jellyfin = config['jellyfin']
+    cert = None
+    client_cert = jellyfin.get('client_cert', None)
+    client_key = jellyfin.get('client_key', None)
+    if client_cert is not None and client_key is not None:
+        cert = (client_cert, client_key)
+
+    key = (jellyfin.get('hostname'), cert)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            keep_alive = jellyfin.get('keep_alive')
+            client = _clients[key] = JellyfinHttpClient(
+                {}, cert, config.get('proxy'),
+                timeout=(
+                    jellyfin.get('connect_timeout') or 5,
+                    jellyfin.get('read_timeout') or 30
+                ),
+                pool_size=jellyfin.get('pool_size') or 10,
+                keep_alive=keep_alive is None or keep_alive,
+                concurrency=jellyfin.get('request_concurrency') or 8
+            )
+
+    return client
+
+
+class RetryPolicy(object):
+    '''
+    Decides which failed requests are tried again and how long to wait
+    first.  Waits grow exponentially with full jitter so clients don't
+    all come back at the same moment after a server restart, unless the
+    server asked for a specific delay with Retry-After.
+
+    Requests that aren't idempotent are only repeated when the server
+    refused them outright, never after a dropped connection where they
+    might already have been processed.
+    '''
+
+    IDEMPOTENT = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    def __init__(self, retries=5, backoff=0.5, max_backoff=30,
+                 statuses=(429, 500, 502, 503, 504), refused=(429, 503)):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+        self.refused = refused
+
+    def should_retry(self, method, attempt, response=None):
+        # Whether a failed request gets another attempt
+        if attempt >= self.retries:
+            return False
+        if response is None:
+            return method in self.IDEMPOTENT
+        if method in self.IDEMPOTENT:
+            return response.status_code in self.statuses
+        return response.status_code in self.refused
+
+    def delay(self, attempt, response=None):
+        # Seconds to wait before the next attempt
+        retry_after = self._retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(response):
+        # Retry-After is either a number of seconds or an http date
+        if response is None:
+            return None
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max(0, (date - now).total_seconds())
+
+
+class CircuitBreaker(object):
+    '''
+    Fails requests immediately once the server has failed `threshold`
+    times in a row, instead of making every caller wait through its own
+    retries.  After `reset_timeout` seconds a single request is let
+    through as a probe, its outcome closes the circuit again or restarts
+    the wait.
+    '''
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        # Thread sending the probe, if one is out
+        self._probing = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened is not None
+
+    def allow(self):
+        # Whether a request may be sent right now
+        with self._lock:
+            if self.opened is None:
+                return True
+            if self._probing:
+                return False
+            if time.monotonic() - self.opened >= self.reset_timeout:
+                self._probing = threading.get_ident()
+                return True
+            return False
+
+    def release(self):
+        # Frees the probe slot of the calling thread if its request ended
+        # without an outcome, so the next request can probe instead
+        with self._lock:
+            if self._probing == threading.get_ident():
+                self._probing = None
+
+    def record_success(self):
+        with self._lock:
+            if self.opened is not None:
+                logger.info('Jellyfin: Server is reachable again')
+            self.failures = 0
+            self.opened = None
+            self._probing = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (
+                    self.opened is None and self.failures >= self.threshold):
+                if self.opened is None:
+                    logger.warning(
+                        'Jellyfin: Server is unavailable, pausing requests '
+                        f'for {self.reset_timeout} seconds')
+                self.opened = time.monotonic()
+            self._probing = None
+
+
+class AsyncTransport(object):
+    '''
+    Event loop on its own thread that fans blocking calls, like requests
+    made through a JellyfinHttpClient, out to a bounded number of worker
+    threads.  Callers on other threads use it through the synchronous
+    `gather`, the loop is started on first use.
+    '''
+
+    def __init__(self, concurrency=8):
+        self.concurrency = concurrency
+        self._loop = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(
+                    max_workers=self.concurrency,
+                    thread_name_prefix='JellyfinAsync'))
+                thread = threading.Thread(
+                    target=loop.run_forever, name='JellyfinEventLoop')
+                thread.daemon = True
+                thread.start()
+                self._loop = loop
+
+        return self._loop
+
+    def _run(self, call):
+        # Runs on a worker thread, marked so nested gathers don't wait on
+        # workers that are all busy waiting themselves
+        self._local.worker = True
+        return call()
+
+    async def _gather(self, calls, limit, return_exceptions):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(limit)
+
+        async def run(call):
+            async with semaphore:
+                return await loop.run_in_executor(None, self._run, call)
+
+        return await asyncio.gather(
+            *(run(call) for call in calls),
+            return_exceptions=return_exceptions
+        )
+
+    def gather(self, calls, limit=None, return_exceptions=False):
+        '''
+        Runs the calls concurrently and returns their results in order
+
+        :param calls: Functions taking no arguments
+        :type calls: iterable
+        :param limit: Max calls running at once, defaults to concurrency
+        :type limit: int
+        :param return_exceptions: Return errors in place of results
+            instead of raising the first one
+        :type return_exceptions: bool
+        :returns: Results
+        :rtype: list
+        '''
+        calls = list(calls)
+        if getattr(self._local, 'worker', False) or len(calls) < 2:
+            results = []
+            for call in calls:
+                try:
+                    results.append(call())
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results.append(e)
+            return results
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._gather(
+                calls, min(limit or self.concurrency, self.concurrency),
+                return_exceptions
+            ),
+            self._get_loop()
+        )
+        return future.result()
+
+
 class JellyfinHttpClient(object):
-    def __init__(self, headers, cert=None, proxy=None):
+    def __init__(self, headers, cert=None, proxy=None, retry=None,
+                 breaker=None, timeout=(5, 30), pool_size=10,
+                 keep_alive=True, concurrency=8):
         http_proxy = httpclient.format_proxy(proxy)
         user_agent = httpclient.format_user_agent(
             '/'.join(
@@ -23,121 +285,233 @@ class JellyfinHttpClient(object):
         self.session.proxies.update({'http': http_proxy, 'https': http_proxy})
         self.session.headers.update(self.headers)
         self.session.headers.update({'user-agent': user_agent})
+        # Enough connections for the actor, the read ahead threads and the
+        # frontend to each have their own
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+        # Server urls after following redirects, by configured hostname
+        self._servers = {}
+        self.transport = AsyncTransport(concurrency)
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        # Seconds to connect and to wait for data, as (connect, read)
+        self.timeout = timeout
+        self._local = threading.local()
+        # Cleared while the server address and login are being sorted out
+        self.connected = threading.Event()
+        self.connected.set()
+        self._grace = 0
 
-    def get(self, url):
-        # Perform HTTP Get to the provided URL
-        counter = 0
-        self.session.headers.update(self.headers)
-        while counter <= 5:
+    def expect_connection(self, grace):
+        '''
+        Holds back requests until `connected` is set again.  Until then,
+        requests wait for the connection for at most `grace` seconds from
+        now and fail right away afterwards, except for the ones made
+        inside `connecting()`.
+        '''
+        self._grace = time.monotonic() + grace
+        self.connected.clear()
 
-            try:
-                r = self.session.get(url)
-                try:
-                    rv = r.json()
-                except Exception as e:
-                    logger.info(
-                        'Error parsing Jellyfin data: {}'.format(e)
-                    )
-                    rv = {}
+    @contextmanager
+    def connecting(self):
+        # Lets this thread make the requests needed to get connected
+        self._local.connecting = True
+        try:
+            yield
+        finally:
+            self._local.connecting = False
 
-                logger.debug(str(rv))
+    def _wait_connected(self):
+        if self.connected.is_set() or getattr(
+                self._local, 'connecting', False):
+            return
 
-                return rv
+        wait = self._grace - time.monotonic()
+        remaining = self._remaining()
+        if remaining is not None:
+            wait = min(wait, remaining)
+        if not self.connected.wait(max(0, wait)):
+            raise Exception('Jellyfin server is not connected yet')
 
-            except Exception as e:
-                logger.info(
-                    'Jellyfin connection on try {} with problem: {}'.format(
-                        counter, e
-                    )
-                )
-                counter += 1
+    @contextmanager
+    def deadline(self, seconds):
+        '''
+        Limits the total time the requests made by this thread inside the
+        block may take, retries and backoff included.  Nested deadlines
+        can only shorten the outer one.
+        '''
+        previous = getattr(self._local, 'deadline', None)
+        if seconds:
+            end = time.monotonic() + seconds
+            if previous is not None:
+                end = min(end, previous)
+            self._local.deadline = end
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
 
-        raise Exception('Cant connect to Jellyfin API')
+    def _remaining(self):
+        # Seconds left before the current deadline, None without one
+        deadline = getattr(self._local, 'deadline', None)
+        if deadline is None:
+            return None
+        return deadline - time.monotonic()
 
-    def post(self, url, payload={}):
-        # Perform HTTP Post to the provided URL
-        self.session.headers.update(self.headers)
+    def bind_deadline(self, func):
+        '''
+        Wraps func so it runs under the deadline of the calling thread,
+        for work that is handed to other threads
+        '''
+        end = getattr(self._local, 'deadline', None)
 
-        counter = 0
-        while counter <= 5:
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            remaining = None if end is None else end - time.monotonic()
+            with self.deadline(remaining):
+                return func(*args, **kwargs)
 
-            try:
-                r = self.session.post(url, json=payload)
-                if r.text:
-                    rv = r.json()
-                else:
-                    rv = r.text
+        return run
 
-                logger.debug(rv)
+    def gather(self, calls, return_exceptions=False):
+        '''
+        Runs independent calls, usually each making a request, at the same
+        time and returns their results in order.  The calls share the
+        deadline of the calling thread, and whether it's refreshing a
+        stale cache entry.
+        '''
+        return self.transport.gather(
+            [self.bind_deadline(bind_refresh(call)) for call in calls],
+            return_exceptions=return_exceptions
+        )
+
+    def _timeout(self):
+        # Request timeouts, shortened to fit in the current deadline
+        remaining = self._remaining()
+        if remaining is None or not self.timeout:
+            return self.timeout
+        if remaining <= 0:
+            raise Exception('Jellyfin request deadline exceeded')
+        return tuple(min(t, remaining) for t in self.timeout)
 
-                return rv
+    def _request(self, method, url, **kwargs):
+        # Send a request, retrying and tracking server health as we go
+        self._wait_connected()
+        self.session.headers.update(self.headers)
+        attempt = 0
+        while True:
+            # Checked before taking a probe slot that it would never use
+            timeout = self._timeout()
+            if not self.breaker.allow():
+                raise Exception('Jellyfin server is unavailable')
 
-            except Exception as e:
+            response = None
+            try:
+                response = self.session.request(
+                    method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
                 logger.info(
                     'Jellyfin connection on try {} with problem: {}'.format(
-                        counter, e
+                        attempt, e
                     )
                 )
-                counter += 1
+                self.breaker.record_failure()
+                if not self.retry.should_retry(method, attempt):
+                    raise Exception('Cant connect to Jellyfin API')
+            else:
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if response.status_code not in self.retry.statuses:
+                    return response
+                logger.info(
+                    'Jellyfin request on try {} failed with status {}'.format(
+                        attempt, response.status_code
+                    )
+                )
+                if not self.retry.should_retry(method, attempt, response):
+                    raise Exception('Jellyfin API returned {}'.format(
+                        response.status_code))
+            finally:
+                # Requests that failed some other way don't keep the probe
+                self.breaker.release()
 
-        raise Exception('Cant connect to Jellyfin API')
+            delay = self.retry.delay(attempt, response)
+            remaining = self._remaining()
+            if remaining is not None and delay >= remaining:
+                raise Exception('Jellyfin request deadline exceeded')
+            time.sleep(delay)
+            attempt += 1
 
-    def delete(self, url):
-        # Perform HTTP Delete to the provided URL
-        counter = 0
-        self.session.headers.update(self.headers)
-        while counter <= 5:
+    def get(self, url):
+        # Perform HTTP Get to the provided URL
+        r = self._request('GET', url)
+        try:
+            rv = r.json()
+        except Exception as e:
+            logger.info(
+                'Error parsing Jellyfin data: {}'.format(e)
+            )
+            rv = {}
 
-            try:
-                r = self.session.delete(url)
+        logger.debug(str(rv))
 
-                logger.debug(str(r))
+        return rv
 
-                return r
+    def post(self, url, payload={}):
+        # Perform HTTP Post to the provided URL
+        r = self._request('POST', url, json=payload)
+        if r.text:
+            rv = r.json()
+        else:
+            rv = r.text
 
-            except Exception as e:
-                logger.info(
-                    'Jellyfin connection on try {} with problem: {}'.format(
-                        counter, e
-                    )
-                )
-                counter += 1
+        logger.debug(rv)
 
-        raise Exception('Cant connect to Jellyfin API')
+        return rv
 
-    def check_redirect(self, server):
-        # Perform HTTP Get to public endpoint to check for redirects
-        counter = 0
-        self.session.headers.update(self.headers)
-        path = '/system/info/public'
+    def get_content(self, url):
+        # Perform HTTP Get for binary data like images
+        r = self._request('GET', url)
+        r.raise_for_status()
 
-        if 'http' not in server:
-            server = 'http://' + server
+        return r.content
 
-        while counter <= 5:
+    def delete(self, url):
+        # Perform HTTP Delete to the provided URL
+        r = self._request('DELETE', url)
 
-            try:
-                r = self.session.get(f'{server}{path}')
-                r.raise_for_status()
+        logger.debug(str(r))
 
-                return r.url.replace(path, '')
+        return r
 
-            except Exception as e:
-                logger.error(
-                    'Failed to reach Jellyfin public API on try {} with problem: {}'.format(
-                        counter, e
-                    )
-                )
-                counter += 1
+    def check_redirect(self, server):
+        # Perform HTTP Get to public endpoint to check for redirects
+        if server in self._servers:
+            return self._servers[server]
 
-        raise Exception('Unable to find Jellyfin server, check hostname config')
+        path = '/system/info/public'
+
+        url = server
+        if 'http' not in url:
+            url = 'http://' + url
 
-    def head(self, item_id, url):
-        # Used to verify if an image exists
         try:
-            r = self.session.head(url)
+            r = self._request('GET', f'{url}{path}')
             r.raise_for_status()
-            return True
-        except:
-            logger.debug(f'No primary image found for item {item_id}')
-            return False
+
+            self._servers[server] = r.url.replace(path, '')
+            return self._servers[server]
+
+        except Exception as e:
+            logger.error(
+                'Failed to reach Jellyfin public API with problem: {}'.format(
+                    e)
+            )
+
+        raise Exception('Unable to find Jellyfin server, check hostname config')
@@ -0,0 +1,214 @@
+from __future__ import unicode_literals
+
+import functools
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import tornado.ioloop
+import tornado.web
+
+from mopidy_jellyfin.http import get_client
+from mopidy_jellyfin.utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Path the image proxy is mounted on by Mopidy's HTTP server
+PROXY_PATH = '/jellyfin/image'
+
+# Leading bytes of the image formats the server may send besides JPEG
+IMAGE_TYPES = (
+    (b'\x89PNG', 'image/png'),
+    (b'GIF8', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+)
+
+
+def image_params(config):
+    '''
+    Query parameters making the server scale artwork down, from the
+    image_max_width and image_quality settings
+    '''
+    jellyfin = config['jellyfin']
+    params = {}
+    if jellyfin.get('image_max_width'):
+        params['maxWidth'] = jellyfin.get('image_max_width')
+    if jellyfin.get('image_quality'):
+        params['quality'] = jellyfin.get('image_quality')
+
+    return params
+
+
+def content_type(data):
+    for magic, mime_type in IMAGE_TYPES:
+        if data.startswith(magic):
+            return mime_type
+
+    return 'image/jpeg'
+
+
+class ImageCache(object):
+    '''
+    Images saved to disk, the least recently used ones are deleted once
+    they take up more than max_bytes.  Reading an image touches its file
+    so the order survives restarts.  The images served last are also kept
+    in memory, which lets concurrent misses for one image share a fetch.
+    '''
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._files = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._recent = LRUCache(maxsize=16, ttl=60)
+
+        os.makedirs(path, exist_ok=True)
+        entries = []
+        for entry in os.scandir(path):
+            if entry.name.endswith('.tmp'):
+                # Left behind by an interrupted write
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            elif entry.is_file():
+                entries.append(entry)
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            self._files[entry.name] = entry.stat().st_size
+            self._size += entry.stat().st_size
+        with self._lock:
+            self._evict()
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+
+        path = os.path.join(self.path, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._size -= self._files.pop(name, 0)
+            return None
+
+        return data
+
+    def get_or_fetch(self, name, fetch):
+        '''
+        Returns the image, calling fetch to get it from the server if it
+        isn't cached.  Only one fetch runs per image at a time.
+        '''
+        return self._recent.get_or_load(
+            name, functools.partial(self._load, name, fetch))
+
+    def _load(self, name, fetch):
+        data = self.get(name)
+        if data is None:
+            data = fetch()
+            self.set(name, data)
+        return data
+
+    def set(self, name, data):
+        path = os.path.join(self.path, name)
+        temp = None
+        try:
+            fd, temp = tempfile.mkstemp(
+                prefix=f'{name}.', suffix='.tmp', dir=self.path)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+        except OSError as e:
+            logger.info(f'Jellyfin: Unable to save image {name}: {e}')
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
+            return
+
+        with self._lock:
+            self._size += len(data) - self._files.pop(name, 0)
+            self._files[name] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._files:
+            name, size = self._files.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+
+class ImageHandler(tornado.web.RequestHandler):
+    '''
+    Serves the primary image of a Jellyfin item, from the disk cache if
+    it's there.  The server is asked with the backend's credentials, so
+    clients never see the access token.
+    '''
+
+    def initialize(self, config, cache):
+        self.config = config
+        self.cache = cache
+        self.http = get_client(config)
+        self.params = image_params(config)
+
+    def _fetch(self, item_id, tag):
+        hostname = self.config['jellyfin'].get('hostname').strip('/')
+        hostname = self.http.check_redirect(hostname)
+        params = urlencode(dict(self.params, tag=tag))
+
+        return self.http.get_content(
+            f'{hostname}/Items/{item_id}/Images/Primary?{params}')
+
+    async def get(self, item_id, tag):
+        # Scaled images are stored separately from full size ones
+        name = '-'.join(
+            [item_id, tag] + [str(value) for value in self.params.values()])
+        try:
+            data = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.cache.get_or_fetch, name,
+                functools.partial(self._fetch, item_id, tag))
+        except Exception as e:
+            logger.info(f'Jellyfin: Failed to fetch image {item_id}: {e}')
+            raise tornado.web.HTTPError(502)
+
+        self.set_header('Content-Type', content_type(data))
+        # The tag is part of the url, so a url always gets the same image
+        self.set_header('Cache-Control', 'public, max-age=31536000, immutable')
+        self.write(data)
+
+
+def factory(config, core):
+    from mopidy_jellyfin import Extension
+
+    # Without the proxy nothing should hand out images with the backend's
+    # credentials
+    if not config['jellyfin'].get('image_proxy'):
+        return []
+
+    cache_size = config['jellyfin'].get('image_cache_size')
+    if cache_size is None:
+        cache_size = 100
+    cache = ImageCache(
+        os.path.join(Extension.get_cache_dir(config), 'images'),
+        cache_size * 1024 * 1024
+    )
+
+    return [
+        (r'/image/([0-9a-fA-F]+)/([0-9a-fA-F]+)', ImageHandler,
+         {'config': config, 'cache': cache}),
+    ]
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import functools
 import logging
 
 from mopidy import backend, models
@@ -8,11 +9,24 @@ from mopidy import backend, models
 logger = logging.getLogger(__name__)
 
 
+def deadline(func):
+    # Bound the time a library or playlists call may spend on server
+    # requests, so a hanging server doesn't block the backend actor
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        remote = self.backend.remote
+        with remote.http.deadline(remote.request_deadline):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
 class JellyfinLibraryProvider(backend.LibraryProvider):
 
     root_directory = models.Ref.directory(uri='jellyfin:',
                                           name='Jellyfin')
 
+    @deadline
     def browse(self, uri):
         # display top level libraries
         if uri == self.root_directory.uri:
@@ -48,47 +62,101 @@ class JellyfinLibraryProvider(backend.LibraryProvider):
     def lookup(self, uri=None, uris=None):
         logger.debug('Jellyfin lookup: {}'.format(uri or uris))
         if uri:
+            return self._lookup(uri)
+
+        else:
+            try:
+                results = self._lookup_many(uris)
+            except Exception as e:
+                logger.warning(f'Jellyfin: Bulk lookup failed: {e}')
+                results = {}
+
+            # Anything the bulk requests didn't cover is looked up alone
+            for uri in uris:
+                if uri not in results:
+                    results[uri] = self._lookup(uri)
+
+            return results
+
+    @deadline
+    def _lookup_many(self, uris):
+        # Tracks, albums and artists are fetched a batch at a time instead
+        # of one request per uri
+        ids = {'track': [], 'album': [], 'artist': []}
+        for uri in uris:
             parts = uri.split(':')
+            if len(parts) == 3 and parts[1] in ids:
+                ids[parts[1]].append(parts[2])
+
+        remote = self.backend.remote
+        found = {
+            'track': {
+                item_id: [track] for item_id, track in
+                remote.get_tracks(ids['track']).items()},
+            'album': remote.lookup_albums(ids['album']),
+            'artist': remote.lookup_artists(ids['artist']),
+        }
+
+        results = {}
+        for uri in uris:
+            parts = uri.split(':')
+            if len(parts) == 3 and parts[2] in found.get(parts[1], {}):
+                results[uri] = found[parts[1]][parts[2]]
+            elif uri.startswith('jellyfin:track:'):
+                # Not on the server anymore
+                results[uri] = []
 
-            if uri.startswith('jellyfin:track:') and len(parts) == 3:
-                track_id = parts[-1]
-                contents = [self.backend.remote.get_track(track_id)]
+        return results
 
-            elif uri.startswith('jellyfin:album:') and len(parts) == 3:
-                album_id = parts[-1]
-                album_data = self.backend.remote.get_directory(album_id)
-                contents = [
-                    self.backend.remote.create_track(track)
-                    for track in album_data.get('Items', [])
-                    if track.get('Type') == 'Audio'
-                ]
+    @deadline
+    def _lookup(self, uri):
+        # Each uri gets its own time budget
+        parts = uri.split(':')
 
-                contents = sorted(contents, key=lambda k: (k.track_no, k.name))
+        if uri.startswith('jellyfin:track:') and len(parts) == 3:
+            track_id = parts[-1]
+            contents = [self.backend.remote.get_track(track_id)]
 
-            elif uri.startswith('jellyfin:artist:') and len(parts) == 3:
-                artist_id = parts[-1]
+        elif uri.startswith('jellyfin:album:') and len(parts) == 3:
+            album_id = parts[-1]
+            album_data = self.backend.remote.get_directory(album_id)
+            contents = self.backend.remote.create_tracks([
+                track for track in album_data.get('Items', [])
+                if track.get('Type') == 'Audio'
+            ])
 
-                contents = self.backend.remote.lookup_artist(artist_id)
+            contents = sorted(contents, key=lambda k: (k.track_no, k.name))
 
-            elif uri.startswith('jellyfin:directory:') or uri == 'jellyfin:':
-                # Prevents weirdness when using Iris, this gets redirected to browse()
-                contents = []
+        elif uri.startswith('jellyfin:artist:') and len(parts) == 3:
+            artist_id = parts[-1]
 
-            else:
-                logger.info('Unknown Jellyfin lookup URI: {}'.format(uri))
-                contents = []
+            contents = self.backend.remote.lookup_artist(artist_id)
 
-            return contents
+        elif uri.startswith('jellyfin:directory:') or uri == 'jellyfin:':
+            # Prevents weirdness when using Iris, this gets redirected to
+            # browse()
+            contents = []
 
         else:
-            return {uri: self.lookup(uri=uri) for uri in uris}
+            logger.info('Unknown Jellyfin lookup URI: {}'.format(uri))
+            contents = []
+
+        return contents
 
+    @deadline
     def search(self, query=None, uris=None, exact=False):
         logger.debug('Jellyfin Search Query: {}'.format(query))
         if exact:
             return self.backend.remote.exact_search(query)
+
+        # Queries on fields the index doesn't have go to the server, rather
+        # than ignoring the field and returning too much
+        index = self.backend.search_index
+        if index is not None and index.ready and index.supports(query or {}):
+            return index.search(query)
         return self.backend.remote.search(query)
 
+    @deadline
     def get_distinct(self, field, query=None):
         # Populates Media Library sections (Artists, Albums, etc)
         # Mopidy internally calls search() with exact=True
@@ -100,21 +168,17 @@ class JellyfinLibraryProvider(backend.LibraryProvider):
             return [album.get('Name') for album in albums]
         return []
 
+    @deadline
     def get_images(self, uris):
         # Provides links to images for provided URI
         # Seems semi unreliable and is very frontend dependent
-        results = {}
-
-        for uri in uris:
-            parts = uri.split(':')
-            if len(parts) == 3:
-                item_id = parts[-1]
-                image = self.backend.remote.get_image(item_id)
-                if image:
-                    results[uri] = [image]
-                else:
-                    results[uri] = []
-            else:
-                results[uri] = []
-
-        return results
+        item_ids = {
+            uri: uri.split(':')[-1] for uri in uris
+            if len(uri.split(':')) == 3
+        }
+        images = self.backend.remote.get_images(list(item_ids.values()))
+
+        return {
+            uri: images.get(item_ids[uri], []) if uri in item_ids else []
+            for uri in uris
+        }
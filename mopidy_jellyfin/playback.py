@@ -6,6 +6,7 @@ import string
 
 from mopidy import backend
 import mopidy_jellyfin
+from mopidy_jellyfin.remote import STARTUP_GRACE
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +18,10 @@ class JellyfinPlaybackProvider(backend.PlaybackProvider):
         super(JellyfinPlaybackProvider, self).__init__(audio, backend)
 
     def translate_uri(self, uri):
+        if not self.backend.remote.ready.wait(STARTUP_GRACE):
+            logger.warning('Jellyfin: Not connected to the server yet')
+            return None
+
         if uri.startswith('jellyfin:track:') and len(uri.split(':')) == 3:
             item_id = uri.split(':')[-1]
             # Build unique session ID
@@ -1,21 +1,87 @@
 from __future__ import unicode_literals
 
+import functools
 import logging
 import operator
+import threading
 
 from mopidy import backend
 from mopidy.models import Playlist, Ref
 
+from mopidy_jellyfin.library import deadline
+from mopidy_jellyfin.records import TrackStore
+from mopidy_jellyfin.utils import LRUCache
+
 logger = logging.getLogger(__name__)
 
+# Kinds of favorites playlists, 'All' combines the others
+FAVORITES = ('Tracks', 'Albums', 'Artists')
+
 
 class JellyfinPlaylistsProvider(backend.PlaylistsProvider):
 
     def __init__(self, *args, **kwargs):
         super(JellyfinPlaylistsProvider, self).__init__(*args, **kwargs)
+        # Playlists without their tracks, which are only fetched when a
+        # playlist is looked at and then kept in _contents as track records
         self._playlists = {}
+        # Records of the tracks in _contents, shared between playlists
+        self._records = TrackStore()
+        self._contents = LRUCache(
+            maxsize=self.backend.config['jellyfin'].get(
+                'playlist_cache_size') or 20,
+            ttl=86400
+        )
+        # DateLastSaved and ChildCount of each server playlist as of the
+        # last refresh
+        self._versions = {}
+        # Favorited items per kind of favorites playlist
+        self._favorites = {}
+        self._lock = threading.RLock()
+        # Serve the saved playlists until the backend has connected
+        self._load_snapshot()
+
+    def load(self):
+        '''
+        Fetches the playlists once the backend has connected to the server
+        '''
+        if not self._playlists:
+            # The saved copy may only be available after logging in
+            self._load_snapshot()
         self.refresh()
 
+    def _load_snapshot(self):
+        '''
+        Restores the playlists saved by the last refresh, if still fresh
+        '''
+        store = self.backend.remote.store
+        if store is None:
+            return False
+
+        snapshot = store.get('playlists', 'all')
+        if not snapshot:
+            return False
+
+        self._playlists = {
+            playlist.uri: playlist.replace(tracks=[])
+            for playlist in snapshot
+        }
+        self._versions = store.get('playlists', 'versions') or {}
+        backend.BackendListener.send('playlists_loaded')
+
+        return True
+
+    def _save_snapshot(self):
+        store = self.backend.remote.store
+        if store is not None:
+            store.set('playlists', 'all', list(self._playlists.values()))
+            store.set('playlists', 'versions', self._versions)
+
+    def _publish(self, playlists):
+        self._playlists = playlists
+        self._save_snapshot()
+        backend.BackendListener.send('playlists_loaded')
+
     def as_list(self):
         '''
         Returns a list of playlist names sorted in alpha order
@@ -26,70 +92,163 @@ class JellyfinPlaylistsProvider(backend.PlaylistsProvider):
 
         return sorted(refs, key=operator.attrgetter('name'))
 
+    @deadline
     def get_items(self, uri):
         '''
         Query local playlist cache for a given playlist, returns tracks
         '''
-        playlist = self._playlists.get(uri)
-        if not playlist:
+        if uri not in self._playlists:
             logger.info('Jellyfin: No playlists found')
             return None
 
-        return [Ref.track(uri=i.uri, name=i.name) for i in playlist.tracks]
+        return [Ref.track(uri=i.uri, name=i.name) for i in self._tracks(uri)]
 
+    @deadline
     def lookup(self, uri):
         '''
         Query playlist cache for a given playlist, return full object
         '''
         playlist = self._playlists.get(uri)
+        if playlist is None:
+            return None
 
-        return Playlist(
-            uri=playlist.uri,
-            name=playlist.name,
-            tracks=playlist.tracks
-        )
+        return playlist.replace(
+            tracks=[record.track() for record in self._tracks(uri)])
+
+    def _tracks(self, uri):
+        # Track records of a playlist, fetched on first use
+        return self._contents.get_or_load(
+            uri, functools.partial(self._load_tracks, uri))
+
+    def _load_tracks(self, uri):
+        return tuple(
+            self._records.add(record) for record in self._load_records(uri))
+
+    def _load_records(self, uri):
+        playlist_id = uri.split(':')[-1]
+        if playlist_id.startswith('favorite-'):
+            kind = playlist_id[len('favorite-'):]
+            if kind == 'All':
+                # 'All' should include the other 3 lists combined
+                return tuple(
+                    track for other in FAVORITES
+                    if f'jellyfin:playlist:favorite-{other}' in self._playlists
+                    for track in self._tracks(
+                        f'jellyfin:playlist:favorite-{other}')
+                )
+            return self.backend.remote.get_favorite_tracks(
+                kind, self._favorites.get(kind, []))
+
+        contents = self.backend.remote.get_playlist_contents(playlist_id)
+        # Create track records for audio and book files
+        return self.backend.remote.create_records([
+            track for track in contents if track['Type'] in ['Audio', 'Book']
+        ])
 
+    @deadline
     def refresh(self):
         '''
-        Generates a list of the playlists stored on the server and their
-        contents and caches it locally
+        Generates a list of the playlists stored on the server and caches
+        it locally, their contents are fetched when they're looked at
+        '''
+        if not self.backend.remote.ready.is_set():
+            logger.debug('Jellyfin: Not connected yet, keeping playlists')
+            return []
+
+        with self._lock:
+            playlists = self._fetch_playlists()
+            playlists.update(self.favorites())
+            self._publish(playlists)
+
+        return []
+
+    def _fetch_playlists(self, changed=()):
+        '''
+        Lists the server playlists, dropping the cached contents of the
+        ones that changed since the last refresh or are listed in changed
         '''
         playlists = {}
+        versions = {}
 
-        raw_playlists = self.backend.remote.get_playlists()
-        if raw_playlists:
-            for playlist in raw_playlists:
-                playlist_id = playlist.get('Id')
-                playlist_uri = 'jellyfin:playlist:%s' % playlist.get('Id')
-                contents = self.backend.remote.get_playlist_contents(
-                    playlist_id
-                )
-                # Create local Mopidy tracks for audio and book files
-                tracks = [
-                    self.backend.remote.create_track(track)
-                    for track in contents if track['Type'] in ['Audio', 'Book']
-                ]
-                # Only create a playlist if it has valid tracks
-                if tracks:
-                    playlists[playlist_uri] = Playlist(
-                        uri='jellyfin:playlist:%s' % playlist.get('Id'),
-                        name=playlist.get('Name'),
-                        tracks=tracks
-                    )
-
-        playlists.update(self.favorites())
+        for raw_playlist in self.backend.remote.get_playlists() or []:
+            playlist_id = raw_playlist.get('Id')
+            uri = 'jellyfin:playlist:%s' % playlist_id
+            version = [
+                raw_playlist.get('DateLastSaved'),
+                raw_playlist.get('ChildCount')
+            ]
+            if (not version[0] or playlist_id in changed or
+                    self._versions.get(playlist_id) != version):
+                self._contents.pop(uri)
+            versions[playlist_id] = version
 
-        self._playlists = playlists
-        backend.BackendListener.send('playlists_loaded')
+            # Only list playlists that have something in them
+            if version[1] != 0:
+                playlists[uri] = Playlist(
+                    uri=uri, name=raw_playlist.get('Name'))
 
-        return []
+        for uri in set(self._playlists) - set(playlists):
+            self._contents.pop(uri)
+        self._versions = versions
+
+        return playlists
+
+    def _update(self, changed=()):
+        # Refreshes the server playlists but keeps the favorites as they are
+        with self._lock:
+            playlists = {
+                uri: playlist for uri, playlist in self._playlists.items()
+                if 'favorite-' in uri
+            }
+            playlists.update(self._fetch_playlists(changed))
+            self._publish(playlists)
+
+    def invalidate(self, updated=(), removed=(), added=()):
+        '''
+        Drops the cached contents of the playlists affected by a server
+        side library change
+        '''
+        changed = set(updated) | set(added)
+        removed = set(removed)
+        if not (changed or removed):
+            return
+
+        # Playlists holding a changed track have to be rebuilt, even if
+        # the playlist itself wasn't saved
+        affected = changed | removed
+        for uri in self._playlists:
+            tracks = self._contents.get(uri, count=False) or ()
+            if any(track.id in affected for track in tracks):
+                if 'favorite-' in uri:
+                    self._contents.pop(uri)
+                else:
+                    changed.add(uri.split(':')[-1])
+
+        self._update(changed)
+
+    def user_data_changed(self, user_data):
+        '''
+        Rebuilds the favorites playlists if an item was (un)favorited
+        '''
+        favorite_ids = self.backend.remote.favorite_ids
+        if not any(bool(data.get('IsFavorite')) != (
+                data.get('ItemId') in favorite_ids) for data in user_data):
+            return
+
+        with self._lock:
+            playlists = {
+                uri: playlist for uri, playlist in self._playlists.items()
+                if 'favorite-' not in uri
+            }
+            playlists.update(self.favorites())
+            self._publish(playlists)
 
     def create(self, name):
         '''
         Creates a new playlist, adds to the local cache
         '''
         playlist = self.backend.remote.create_playlist(name)
-        self.refresh()
+        self._update()
 
         return Playlist(
             uri='jellyfin:playlist:{}'.format(playlist.get('Id')),
@@ -109,8 +268,11 @@ class JellyfinPlaylistsProvider(backend.PlaylistsProvider):
 
             # True if the delete succeeded, False if there was an error
             if result:
-                del self._playlists[uri]
-                self.refresh()
+                with self._lock:
+                    playlists = dict(self._playlists)
+                    playlists.pop(uri, None)
+                    self._versions.pop(playlist_id, None)
+                    self._publish(playlists)
                 return True
         return False
 
@@ -132,21 +294,24 @@ class JellyfinPlaylistsProvider(backend.PlaylistsProvider):
             playlist_id, new_track_ids
         )
 
-        # Update the playlist views
-        self.refresh()
+        # Update the playlist views, only the saved playlist is fetched
+        self._update({playlist_id})
         return playlist
 
     def favorites(self):
         '''
-        Get list of playlists based on favorited items
+        Get list of playlists based on favorited items, their tracks are
+        only built when they're looked at
         '''
         playlists = {}
-        favorite_playlists = self.backend.remote.get_favorites()
+        self._favorites = self.backend.remote.get_favorite_items()
 
-        for name, contents in favorite_playlists.items():
-            if contents:
-                uri = f'jellyfin:playlist:favorite-{name}'
-                playlists[uri] = Playlist(
-                    uri=uri, name=f'Favorites - {name}', tracks=contents)
+        names = [name for name in FAVORITES if self._favorites.get(name)]
+        if names:
+            names.append('All')
+        for name in names:
+            uri = f'jellyfin:playlist:favorite-{name}'
+            self._contents.pop(uri)
+            playlists[uri] = Playlist(uri=uri, name=f'Favorites - {name}')
 
         return playlists
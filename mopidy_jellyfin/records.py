@@ -0,0 +1,154 @@
+from __future__ import unicode_literals
+
+import sys
+import threading
+import weakref
+
+from mopidy import models
+
+from mopidy_jellyfin.utils import LRUCache
+
+
+def _intern(value):
+    # Names of albums, artists and genres repeat across many tracks
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class ModelCache(object):
+    '''
+    Album and Artist models shared by all tracks built from the same
+    album or artist, instead of every track getting its own copies.
+    Entries are keyed by Jellyfin id along with the metadata the model is
+    built from, so changed items get a new model.
+    '''
+
+    def __init__(self, maxsize=5000):
+        self._artists = LRUCache(maxsize, ttl=86400)
+        self._albums = LRUCache(maxsize, ttl=86400)
+
+    def artist(self, artist_id, name):
+        key = (artist_id, name)
+        artist = self._artists.get(key)
+        if artist is None:
+            artist = models.Artist(
+                name=_intern(name), uri=f'jellyfin:artist:{artist_id}')
+            self._artists.set(key, artist)
+        return artist
+
+    def album(self, album_id, name, artists, date):
+        key = (album_id, name, tuple(artists), date)
+        album = self._albums.get(key)
+        if album is None:
+            album = models.Album(
+                name=_intern(name),
+                artists=artists,
+                uri=f'jellyfin:album:{album_id}',
+                date=_intern(date)
+            )
+            self._albums.set(key, album)
+        return album
+
+    def clear(self):
+        self._artists.clear()
+        self._albums.clear()
+
+
+# Models shared by every track the backend builds
+flyweights = ModelCache()
+
+
+class TrackRecord(object):
+    '''
+    Compact copy of the metadata a Mopidy Track is built from.  Tracks
+    held for a long time, like playlist contents and the search index,
+    are kept as records and only turned into Track models when they're
+    handed to Mopidy.  Albums and artists are shared models from
+    `flyweights`.
+    '''
+
+    __slots__ = (
+        'id', 'name', 'bitrate', 'track_no', 'disc_no', 'genre', 'length',
+        'date', 'artists', 'album', '__weakref__'
+    )
+
+    def __init__(self, id, name, bitrate=0, track_no=0, disc_no=None,
+                 genre='', length=0, date=None, artists=(), album=None):
+        self.id = id
+        self.name = name
+        self.bitrate = bitrate
+        self.track_no = track_no
+        self.disc_no = disc_no
+        self.genre = _intern(genre)
+        self.length = length
+        self.date = _intern(date)
+        self.artists = tuple(artists)
+        self.album = album
+
+    def _values(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__[:-1])
+
+    def __eq__(self, other):
+        if not isinstance(other, TrackRecord):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'TrackRecord({self.id!r}, {self.name!r})'
+
+    @property
+    def uri(self):
+        return f'jellyfin:track:{self.id}'
+
+    def track(self):
+        '''
+        Builds the Mopidy Track of the record
+        '''
+        return models.Track(
+            uri=self.uri,
+            name=self.name,
+            bitrate=self.bitrate,
+            track_no=self.track_no,
+            disc_no=self.disc_no,
+            genre=self.genre,
+            artists=self.artists,
+            album=self.album,
+            length=self.length,
+            date=self.date
+        )
+
+
+def as_model(value):
+    # Mopidy model of a record, other values are models already
+    if isinstance(value, TrackRecord):
+        return value.track()
+    return value
+
+
+class TrackStore(object):
+    '''
+    Track records keyed by item id, so a track that's in several playlists
+    is only held once.  Records are dropped as soon as nothing uses them,
+    a newer copy of a track replaces the one stored.
+    '''
+
+    def __init__(self):
+        self._records = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, record):
+        with self._lock:
+            known = self._records.get(record.id)
+            if known is not None and known == record:
+                return known
+            self._records[record.id] = record
+            return record
@@ -1,13 +1,22 @@
 from __future__ import unicode_literals
 
 from mopidy import httpclient, models
-from mopidy_jellyfin.utils import cache
+from mopidy_jellyfin.utils import (
+    cache, configure_caches, parse_cache_sizes, playlist_edits
+)
 import mopidy_jellyfin
-from .http import JellyfinHttpClient
+from .http import get_client
+from .images import PROXY_PATH, image_params
+from .records import TrackRecord, flyweights
+from .store import MetadataStore
 from unidecode import unidecode
+import functools
 import os
 import logging
-from collections import OrderedDict, defaultdict
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import sys
 if sys.version.startswith('3'):
     from urllib.parse import (
@@ -25,11 +34,51 @@ else:
 
 logger = logging.getLogger(__name__)
 
+# Seconds requests made while still connecting to the server at startup
+# wait for the connection, before failing right away
+STARTUP_GRACE = 10
+
+# Query parameters per kind of request, so the server leaves out the parts
+# of each item the code reading the response doesn't use
+FIELD_PROFILES = {
+    # Refs for browsing only need the id, name and type
+    'browse': {
+        'EnableImages': 'false',
+        'EnableUserData': 'false',
+        'Fields': ''
+    },
+    # Everything create_track and friends read, MediaSources is only there
+    # for the audio bitrate
+    'track': {
+        'EnableImages': 'false',
+        'EnableUserData': 'false',
+        'Fields': 'MediaSources,Genres'
+    },
+    # Tracks and albums kept by the library mirror, with their image tags
+    'sync': {
+        'EnableImages': 'true',
+        'EnableImageTypes': 'Primary',
+        'ImageTypeLimit': '1',
+        'EnableUserData': 'false',
+        'Fields': 'MediaSources,Genres,SortName,DateCreated'
+    },
+    # Only the primary image tags, for building image urls
+    'image': {
+        'EnableImages': 'true',
+        'EnableImageTypes': 'Primary',
+        'ImageTypeLimit': '1',
+        'EnableUserData': 'false',
+        'Fields': ''
+    },
+}
+
+# Max number of ids put in a single query, to keep the URLs short
+IDS_PER_QUERY = 100
+
 
 class JellyfinHandler(object):
     def __init__(self, config):
         self.config = config
-        proxy = config.get('proxy')
         jellyfin = config.get('jellyfin')
         self.hostname = jellyfin.get('hostname')
         self.hostname = self.hostname.strip('/')
@@ -54,28 +103,92 @@ class JellyfinHandler(object):
         else:
             self.max_bitrate = '140000000'
         self.watched_status = jellyfin.get('watched_status')
-        cert = None
-        client_cert = jellyfin.get('client_cert', None)
-        client_key = jellyfin.get('client_key', None)
-        if client_cert is not None and client_key is not None:
-            cert = (client_cert, client_key)
+        self.page_size = jellyfin.get('page_size') or 500
+        self.read_ahead = jellyfin.get('page_read_ahead')
+        if self.read_ahead is None:
+            self.read_ahead = 1
         self.album_format = jellyfin.get('album_format', False)
         if not self.album_format:
             self.album_format = '{Name}'
+        # Local copy of the libraries, set by the backend when enabled
+        self.library_sync = None
+        # Ids of everything favorited as of the last get_favorite_items() call
+        self.favorite_ids = set()
+        self.persist_ttl = jellyfin.get('cache_persist_ttl')
+        if self.persist_ttl is None:
+            self.persist_ttl = 86400
+        self.store = None
+        # Seconds a browse, lookup or search may spend waiting on the server
+        self.request_deadline = jellyfin.get('request_deadline')
+        if self.request_deadline is None:
+            self.request_deadline = 30
+        # Sizing of the artwork handed to clients
+        self.image_params = image_params(config)
+        # Hand out urls of the artwork proxy instead of the server's
+        self.image_proxy = jellyfin.get('image_proxy')
+
+        # Set once connect() has found the server and logged in
+        self.ready = threading.Event()
 
         # create authentication headers
         self.auth_data = self._auth_payload()
-        headers = self._create_headers()
-        self.http = JellyfinHttpClient(headers, cert, proxy)
-        response_url = self.http.check_redirect(self.hostname)
-        if self.hostname != response_url:
-            self.hostname = response_url
+        self.http = get_client(config)
+        self.http.headers.update(self._create_headers())
+        self.http.expect_connection(STARTUP_GRACE)
+        # Fetches the pages get_paged reads ahead.  Each thread that may
+        # page through a listing, the actor and every gather worker, gets
+        # read_ahead workers
+        self._pager = None
+        if self.read_ahead:
+            self._pager = ThreadPoolExecutor(
+                max_workers=self.read_ahead * (
+                    self.http.transport.concurrency + 1),
+                thread_name_prefix='JellyfinPager')
+
+        # With a configured user the saved data can be used right away
+        self._open_store()
+
+    def connect(self):
+        """Resolves the server address and logs in.
+
+        Done separately from creating the handler so it can happen in the
+        background, while cached data is already being served.
+        """
+        with self.http.connecting():
+            response_url = self.http.check_redirect(self.hostname)
+            if self.hostname != response_url:
+                self.hostname = response_url
+
+            if not self.token:
+                self._login()
 
         if not self.token:
-            self._login()
+            raise Exception('Unable to login to Jellyfin')
+
+        self.http.headers.update({'x-mediabrowser-token': self.token})
+        if self.store is None:
+            self._open_store()
+
+        self.http.connected.set()
+        self.ready.set()
+
+    def _open_store(self):
+        jellyfin = self.config.get('jellyfin')
+        if self.persist_ttl and self.user_id:
+            # Responses differ between users, so each gets its own database
+            cache_dir = mopidy_jellyfin.Extension.get_cache_dir(self.config)
+            self.store = MetadataStore(
+                os.path.join(cache_dir, f'metadata-{self.user_id}.db'),
+                self.persist_ttl
+            )
+
+        configure_caches(
+            parse_cache_sizes(jellyfin.get('cache_sizes')),
+            jellyfin.get('cache_ttl'),
+            self.store,
+            jellyfin.get('cache_max_stale')
+        )
 
-        if self.token:
-           self.http.session.headers.update({'x-mediabrowser-token': self.token})
     def _save_token(self, token):
         # Save the authentication token where the frontend can also access it
         cache_dir = mopidy_jellyfin.Extension.get_cache_dir(self.config)
@@ -149,6 +262,64 @@ class JellyfinHandler(object):
 
         return urlunsplit((scheme, netloc, path, new_query_string, fragment))
 
+    def _fields(self, profile):
+        """Returns the query parameters of a field profile.
+
+        :param profile: Key of FIELD_PROFILES
+        :type profile: str
+        :returns: Query parameters
+        :rtype: dict
+        """
+        params = dict(FIELD_PROFILES[profile])
+        if self.watched_status and profile not in ('browse', 'image'):
+            # Play counts mark audiobooks as listened to
+            params['EnableUserData'] = 'true'
+
+        return params
+
+    def get_paged(self, endpoint, url_params):
+        """Yields the items of a listing, fetched one page at a time.
+
+        While a page is being consumed the next ones are already requested
+        in the background, up to the configured read ahead.
+
+        :param endpoint: API endpoint
+        :type endpoint: str
+        :param url_params: Query parameters
+        :type url_params: dict
+        :returns: Items
+        :rtype: generator of dict
+        """
+        def fetch(start):
+            params = dict(url_params, StartIndex=start, Limit=self.page_size)
+            return self.http.get(self.api_url(endpoint, params))
+
+        # Pages read ahead on other threads keep the caller's deadline
+        fetch_ahead = self.http.bind_deadline(fetch)
+
+        page = fetch(0)
+        total = page.get('TotalRecordCount', 0)
+        starts = iter(range(self.page_size, total, self.page_size))
+
+        pending = deque()
+        if self.read_ahead and self._pager is not None:
+            for start in islice(starts, self.read_ahead):
+                pending.append(self._pager.submit(fetch_ahead, start))
+
+        while page:
+            for item in page.get('Items', []):
+                yield item
+
+            start = next(starts, None)
+            if pending:
+                if start is not None:
+                    pending.append(self._pager.submit(fetch_ahead, start))
+                page = pending.popleft().result()
+            elif start is not None:
+                page = fetch(start)
+            else:
+                page = None
+
     def get_music_root(self):
         url = self.api_url(
             '/Users/{}/Views'.format(self.user_id)
@@ -196,7 +367,9 @@ class JellyfinHandler(object):
             'UserId': self.user_id,
             'IncludeItemTypes': 'Playlist',
             'Recursive': 'true',
-            'fields': 'MediaSources'
+            **self._fields('browse'),
+            # Used to tell which playlists changed since the last refresh
+            'Fields': 'DateLastSaved,ChildCount'
         }
 
         url = self.api_url('/Users/{}/Items'.format(self.user_id), url_params)
@@ -207,13 +380,11 @@ class JellyfinHandler(object):
     def get_playlist_contents(self, playlist_id):
         url_params = {
             'UserId': self.user_id,
-            'fields': 'MediaSources'
+            **self._fields('track')
         }
-        url = self.api_url('/Playlists/{}/Items'.format(playlist_id), url_params)
 
-        data = self.http.get(url).get('Items', [])
-
-        return data
+        return list(self.get_paged(
+            f'/Playlists/{playlist_id}/Items', url_params))
 
     def create_playlist(self, name):
         url = self.api_url('/Playlists')
@@ -235,58 +406,54 @@ class JellyfinHandler(object):
 
     def update_playlist(self, playlist_id, new_ids):
         curr_tracks = self.get_playlist_contents(playlist_id)
+        curr_ids = [track['Id'] for track in curr_tracks]
 
-        curr_length = len(curr_tracks)
-        new_length = len(new_ids)
-
-        if curr_length == new_length:
-            # If the playlist is the same length, assume a track has moved
-            self.move_playlist_items(playlist_id, curr_tracks, new_ids)
-        elif curr_length > new_length:
-            # If the new playlist is shorter than the old, delete tracks
-            self.delete_from_playlist(playlist_id, curr_tracks, new_ids)
-        else:
-            # If the new playlist is longer than the old, add new tracks
-            self.add_to_playlist(playlist_id, curr_tracks, new_ids)
-
-    def move_playlist_items(self, playlist_id, curr_tracks, new_ids):
-        # Loop through the current and new list, finding the moved track
-        for index,item in enumerate(curr_tracks, 0):
-            if item['Id'] != new_ids[index]:
-                new_index = new_ids.index(item['Id'])
-                # If an item has only moved down 1 slot, it was likely caused
-                # by another track being moved above it
-                if new_index - index != 1:
-                    break
+        removed, added, moves = playlist_edits(curr_ids, new_ids)
 
         # Playlists have their own unique item IDs
-        item_id = item['PlaylistItemId']
-
+        entry_ids = [track['PlaylistItemId'] for track in curr_tracks]
+        if removed:
+            self.delete_from_playlist(
+                playlist_id, [entry_ids[index] for index in removed])
+            removed = set(removed)
+            curr_ids = [
+                item_id for index, item_id in enumerate(curr_ids)
+                if index not in removed]
+            entry_ids = [
+                entry_id for index, entry_id in enumerate(entry_ids)
+                if index not in removed]
+
+        if added:
+            self.add_to_playlist(playlist_id, added)
+            if moves:
+                # The new entries only get their IDs once they're added
+                curr_tracks = self.get_playlist_contents(playlist_id)
+                if [track['Id'] for track in curr_tracks] != curr_ids + added:
+                    logger.warning(
+                        f'Jellyfin: Playlist {playlist_id} changed while '
+                        'saving, not reordering it')
+                    return
+                entry_ids = [track['PlaylistItemId'] for track in curr_tracks]
+
+        # Moves depend on the ones before them, so they're sent in order
+        for position, new_index in moves:
+            self.move_playlist_item(
+                playlist_id, entry_ids[position], new_index)
+
+    def move_playlist_item(self, playlist_id, item_id, new_index):
         url = self.api_url(f'/Playlists/{playlist_id}/Items/{item_id}/Move/{new_index}')
         self.http.post(url)
 
-    def delete_from_playlist(self, playlist_id, curr_tracks, new_ids):
-        curr_ids = [ track['Id'] for track in curr_tracks ]
-
-        # Find items that are in the old playlist but missing from the new one
-        del_items = list(set(curr_ids) - set(new_ids))
-
-        # Get the PlaylistItemId of each track to be deleted
-        del_ids = [ track['PlaylistItemId'] for track in curr_tracks if track['Id'] in del_items ]
-
+    def delete_from_playlist(self, playlist_id, entry_ids):
         url_params = {
             'UserId': self.user_id,
-            'EntryIds': ','.join(del_ids)
+            'EntryIds': ','.join(entry_ids)
         }
         del_url = self.api_url(f'Playlists/{playlist_id}/Items', url_params)
         self.http.delete(del_url)
 
-    def add_to_playlist(self, playlist_id, curr_tracks, new_ids):
-        curr_ids = [ track['Id'] for track in curr_tracks ]
-
-        # Find items in the new playlist that are missing from the old one
-        add_ids = list(set(new_ids) - set(curr_ids))
-
+    def add_to_playlist(self, playlist_id, add_ids):
+        # New items are appended to the end of the playlist
         url_params = {
             'UserId': self.user_id,
             'Ids': ','.join(add_ids)
@@ -294,60 +461,89 @@ class JellyfinHandler(object):
         new_url = self.api_url(f'/Playlists/{playlist_id}/Items', url_params)
         self.http.post(new_url)
 
-    def get_favorites(self):
+    def get_favorite_items(self):
         '''
-        Pulls a list of favorite audio related content from the server and
-        build playlists from it
+        Pulls the favorited tracks, albums and artists from the server,
+        without the tracks of the albums and artists
         '''
-
-        # Types of playlists to build
-        playlists = {
-            'All': [],
-            'Tracks': [],
-            'Albums': [],
-            'Artists': []
-        }
-
         url_params = {
             'Recursive': 'true',
             'Filters': 'IsFavorite',
-            'fields': 'MediaSources'
+            **self._fields('track')
         }
 
-        fav_items_url = self.api_url(f'/Users/{self.user_id}/Items', url_params)
-        fav_items = self.http.get(fav_items_url).get('Items', [])
-
-        for item in fav_items:
-            item_type = item.get('Type')
-            if item_type == 'Audio':
-                playlists['Tracks'].append(self.create_track(item))
-            elif item_type == 'MusicAlbum':
-                # Get tracks from the favorited album
-                tracks = self.get_directory(item.get('Id')).get('Items', [])
-                playlists['Albums'].extend([
-                    self.create_track(track) for track in tracks])
+        fav_items = list(
+            self.get_paged(f'/Users/{self.user_id}/Items', url_params))
 
         # User ID needed for the artists query
         url_params['UserId'] = self.user_id
 
         # Artists aren't available in the previous call and have to be separate
-        fav_artists_url = self.api_url(f'/Artists', url_params)
-        fav_artists = self.http.get(fav_artists_url).get('Items', [])
+        fav_artists = list(self.get_paged('/Artists', url_params))
 
-        for artist in fav_artists:
-            # Get tracks from the favorited artist
-            artist_id = artist.get('Id')
-            playlists['Artists'].extend(self.lookup_artist(artist_id))
+        self.favorite_ids = set(
+            item.get('Id') for item in fav_items + fav_artists)
+
+        return {
+            'Tracks': [i for i in fav_items if i.get('Type') == 'Audio'],
+            'Albums': [i for i in fav_items if i.get('Type') == 'MusicAlbum'],
+            'Artists': fav_artists
+        }
 
-        # 'All' should include the other 3 lists combined
-        playlists['All'].extend(playlists['Tracks'])
-        playlists['All'].extend(playlists['Albums'])
-        playlists['All'].extend(playlists['Artists'])
+    def get_favorite_tracks(self, kind, items):
+        '''
+        Builds the track records of a favorites playlist from the items of
+        that kind returned by get_favorite_items.  The tracks of all
+        favorited albums or artists are fetched together
+        '''
+        ids = [item.get('Id') for item in items]
+        if kind == 'Tracks':
+            return self.create_records(items)
+        elif kind == 'Albums':
+            # Get tracks from the favorited albums, in the order of the albums
+            albums = self._group_tracks(
+                ids, self._get_album_tracks,
+                lambda track: [track.get('AlbumId')])
+            return self.create_records([
+                track for album_id in ids for track in albums[album_id]])
+        elif kind == 'Artists':
+            # Get tracks from the favorited artists
+            artists = self._group_tracks(
+                ids, self._get_artist_tracks, self._track_artist_ids)
+            return self.create_records([
+                track for artist_id in ids
+                for track in self._sort_artist_tracks(artists[artist_id])])
+
+        return []
+
+    def _group_tracks(self, ids, fetch, keys):
+        # Tracks of several albums or artists keyed by album or artist id,
+        # fetched with one query per IDS_PER_QUERY ids
+        groups = defaultdict(list)
+        mirror = self._mirror()
+        for start in range(0, len(ids), IDS_PER_QUERY):
+            chunk = ids[start:start + IDS_PER_QUERY]
+            wanted = set(chunk)
+            if mirror:
+                tracks = [
+                    track for item_id in chunk
+                    for track in fetch(item_id, mirror)]
+            else:
+                tracks = fetch(','.join(chunk))
+            for track in tracks:
+                for key in set(keys(track)) & wanted:
+                    groups[key].append(track)
 
-        return playlists
+        return groups
 
+    def _track_artist_ids(self, track):
+        # Artists a track is listed under when looking up an artist
+        ids = [i.get('Id') for i in track.get('AlbumArtists', [])]
+        if not self.albumartistsort:
+            ids.extend(i.get('Id') for i in track.get('ArtistItems', []))
+        return ids
 
-    @cache()
+    @cache(maxsize=1000, persist=True, aggregate=True, max_stale=86400)
     def browse_item(self, item_id):
         item = self.get_item(item_id)
         if item.get('CollectionType', '') == 'music':
@@ -376,32 +572,108 @@ class JellyfinHandler(object):
 
         return ret_value
 
-    @cache()
+    def get_library_ids(self):
+        # Ids of the music libraries selected in the config
+        return [
+            library.get('Id') for library in self.get_music_root()
+            if library.get('Name') in self.libraries
+        ]
+
+    def get_library_items(self, library_id, min_date=None):
+        '''
+        Yields the albums and tracks in a library, optionally only the ones
+        saved on the server since min_date
+        '''
+        url_params = {
+            'ParentId': library_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': 'MusicAlbum,Audio',
+            'SortOrder': 'Ascending',
+            'SortBy': 'SortName',
+            **self._fields('sync')
+        }
+        if min_date:
+            url_params['MinDateLastSaved'] = min_date
+
+        return self.get_paged(f'/Users/{self.user_id}/Items', url_params)
+
+    def get_library_item_ids(self, library_id):
+        # Ids of every album and track in a library, without any metadata
+        url_params = {
+            'ParentId': library_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': 'MusicAlbum,Audio',
+            'SortBy': 'SortName',
+            **self._fields('browse')
+        }
+        items = self.get_paged(f'/Users/{self.user_id}/Items', url_params)
+
+        return set(item.get('Id') for item in items)
+
+    def get_library_count(self, library_id):
+        # Number of albums and tracks in a library
+        url_params = {
+            'ParentId': library_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': 'MusicAlbum,Audio',
+            'Limit': 0
+        }
+        url = self.api_url(f'/Users/{self.user_id}/Items', url_params)
+
+        return self.http.get(url).get('TotalRecordCount', 0)
+
+    def _mirror(self):
+        # The local library mirror, once it has been populated
+        mirror = self.library_sync
+        if mirror is not None and mirror.ready.is_set():
+            return mirror
+
+    def create_model(self, item):
+        # Mopidy model matching the type of a Jellyfin item
+        item_type = item.get('Type')
+        if item_type == 'MusicArtist':
+            return self.create_artists(item)[0]
+        elif item_type == 'MusicAlbum':
+            return self.create_album(item)
+        return self.create_track(item)
+
+    @cache(maxsize=8, persist=True, aggregate=True, max_stale=86400)
     def get_all_artists(self):
         # Get a list of all artists in the server.  Used for mopidy-iris
+        mirror = self._mirror()
+        if mirror:
+            return mirror.artists()
+
         artists = []
         libraries = self.get_music_root()
 
-        for library in libraries:
-
-            if library.get('Name') in self.libraries:
-                library_id = library.get('Id')
-                artists += self.get_library_artists(library_id)
+        # Fetch the artists of every library at once
+        for library_artists in self.http.gather(
+                functools.partial(self.get_library_artists, library.get('Id'))
+                for library in libraries
+                if library.get('Name') in self.libraries):
+            artists += library_artists
 
         return artists
 
-    @cache()
+    @cache(maxsize=500, persist=True, aggregate=True, max_stale=86400)
     def get_artist_contents(self, artist_id):
         # Get a list of albums for the given artist
         contents = []
         ret_val = []
 
+        mirror = self._mirror()
+        if mirror:
+            contents = mirror.albums_by_artist(
+                artist_id, self.albumartistsort)
+            return [self.get_album_as_ref(album) for album in contents]
+
         # Get album list
         url_params = {
             'UserId': self.user_id,
             'IncludeItemTypes': 'MusicAlbum',
             'Recursive': 'true',
-            'fields': 'MediaSources'
+            **self._fields('browse')
         }
         if self.albumartistsort:
             url_params['AlbumArtistIds'] = artist_id
@@ -417,23 +689,32 @@ class JellyfinHandler(object):
 
         return ret_val
 
-    @cache()
+    @cache(maxsize=16, persist=True, aggregate=True, max_stale=86400)
     def get_library_artists(self, library_id):
         # Get a list of all artists in the given library
+        mirror = self._mirror()
+        if mirror and mirror.has_library(library_id):
+            return mirror.artists(library_id)
+
+        return self.fetch_library_artists(library_id)
+
+    def fetch_library_artists(self, library_id):
+        # Uncached version of get_library_artists
         url_params = {
             'ParentId': library_id,
-            'UserId': self.user_id
+            'UserId': self.user_id,
+            'SortBy': 'SortName',
+            **self._fields('browse')
         }
         if self.albumartistsort:
-            url = self.api_url('/Artists/AlbumArtists', url_params)
+            endpoint = '/Artists/AlbumArtists'
         else:
-            url = self.api_url('/Artists', url_params)
-
-        artists = self.http.get(url).get('Items')
+            endpoint = '/Artists'
 
-        return artists
+        return list(self.get_paged(endpoint, url_params))
 
-    @cache()
+    @cache(maxsize=2000, key=lambda self, artist: (
+        self, artist.get('Id'), artist.get('Name')))
     def get_artist_as_ref(self, artist):
         # Convert artist into mopidy object
         artist_ref = models.Ref.artist(
@@ -445,7 +726,7 @@ class JellyfinHandler(object):
 
         return artist_ref
 
-    @cache()
+    @cache(maxsize=2000)
     def get_album_as_ref(self, album):
         # Convert album into mopidy object
         return models.Ref.album(
@@ -464,7 +745,7 @@ class JellyfinHandler(object):
             name=track.get('Name')
         )
 
-    @cache()
+    @cache(maxsize=256, aggregate=True)
     def get_albums(self, query):
         # Check query for artist name
         if 'artist' in query:
@@ -474,6 +755,11 @@ class JellyfinHandler(object):
         else:
             return []
 
+        mirror = self._mirror()
+        if mirror:
+            return mirror.albums_by_artist_name(
+                raw_artist[0], self.albumartistsort)
+
         # URL encode artist string
         artist = quote(raw_artist[0].encode('utf8')).replace('/', '-')
         url_params= {
@@ -488,7 +774,8 @@ class JellyfinHandler(object):
         url_params = {
             'UserId': self.user_id,
             'IncludeItemTypes': 'MusicAlbum',
-            'Recursive': 'true'
+            'Recursive': 'true',
+            **self._fields('browse')
         }
 
         # Get album list
@@ -504,21 +791,24 @@ class JellyfinHandler(object):
 
         return albums
 
-    @cache()
+    @cache(maxsize=8, persist=True, aggregate=True, max_stale=86400)
     def get_all_albums(self):
         # Get a list of all albums in the library.  Used for mopidy-iris
+        mirror = self._mirror()
+        if mirror:
+            return mirror.albums()
+
         url_params = {
             'UserId': self.user_id,
             'IncludeItemTypes': 'MusicAlbum',
-            'Recursive': 'true'
+            'Recursive': 'true',
+            'SortBy': 'SortName',
+            **self._fields('browse')
         }
 
-        url = self.api_url('/Items', url_params)
-        albums = self.http.get(url).get('Items')
-
-        return albums
+        return list(self.get_paged('/Items', url_params))
 
-    @cache()
+    @cache(maxsize=1000, persist=True, aggregate=True, max_stale=86400)
     def get_directory(self, id):
         """Get directory from Jellyfin API.
 
@@ -527,16 +817,22 @@ class JellyfinHandler(object):
         :returns Directory
         :rtype: dict
         """
+        mirror = self._mirror()
+        if mirror:
+            item = mirror.get(id)
+            if item and item.get('Type') == 'MusicAlbum':
+                return {'Items': mirror.tracks_in_album(id)}
+
         url_params= {
             'ParentId': id,
             'SortOrder': 'Ascending',
             'SortBy': 'SortName',
-            'fields': 'MediaSources'
+            **self._fields('track')
         }
         url = self.api_url('/Users/{}/Items'.format(self.user_id), url_params)
         return self.http.get(url)
 
-    @cache()
+    @cache(maxsize=5000, persist=True, max_stale=86400)
     def get_item(self, id):
         """Get item from Jellyfin API.
 
@@ -545,6 +841,10 @@ class JellyfinHandler(object):
         :returns: Item
         :rtype: dict
         """
+        mirror = self._mirror()
+        if mirror and mirror.get(id):
+            return mirror.get(id)
+
         data = self.http.get(
             self.api_url(
                 '/Users/{}/Items/{}'.format(self.user_id, id)
@@ -563,38 +863,122 @@ class JellyfinHandler(object):
         :returns: Track
         :rtype: mopidy.models.Track
         """
-        # TODO: add more metadata
-        name = track.get('Name')
-        bitrate = 0
-        if self.watched_status and track.get('Type') == 'AudioBook':
-            if track['UserData'].get('PlayCount'):
-                name = f'[X] - {name}'
+        return self.create_record(track).track()
+
+    def create_tracks(self, tracks):
+        """Create tracks from a list of Jellyfin API track dicts.
+
+        :param tracks: Tracks from Jellyfin API
+        :type tracks: list of dict
+        :returns: Tracks
+        :rtype: list of mopidy.models.Track
+        """
+        return [record.track() for record in self.create_records(tracks)]
+
+    def create_record(self, track):
+        """Create compact track record from Jellyfin API track dict.
+
+        :param track: Track from Jellyfin API
+        :type track: dict
+        :returns: Track record
+        :rtype: mopidy_jellyfin.records.TrackRecord
+        """
+        return self.create_records([track])[0]
+
+    def create_records(self, tracks):
+        """Create compact track records from a list of Jellyfin API track
+        dicts.
+
+        Albums and artists come from the shared flyweights.  Within a batch
+        each album and list of artists is only looked up once, keyed by
+        everything the flyweights are keyed by.  Building Track models
+        still costs far more than the records, see
+        tests/benchmark_create_tracks.py.
+
+        :param tracks: Tracks from Jellyfin API
+        :type tracks: list of dict
+        :returns: Track records
+        :rtype: list of mopidy_jellyfin.records.TrackRecord
+        """
+        artist_lists = {}
+        albums = {}
+
+        def artists_of(entries):
+            key = tuple(
+                (entry.get('Id'), entry.get('Name')) for entry in entries)
+            found = artist_lists.get(key)
+            if found is None:
+                found = artist_lists[key] = [
+                    flyweights.artist(*pair) for pair in key]
+            return key, found
+
+        records = []
+        for track in tracks:
+            # TODO: add more metadata
+            item_type = track.get('Type')
+            name = track.get('Name')
+            if self.watched_status and item_type == 'AudioBook':
+                if track.get('UserData', {}).get('PlayCount'):
+                    name = f'[X] - {name}'
+                else:
+                    name = f'[] - {name}'
+
+            bitrate = 0
+            for source in track.get('MediaSources', ()):
+                for stream in source.get('MediaStreams', ()):
+                    if stream.get('Type') == 'Audio':
+                        # Server returns bitrate in bits/sec, we need kbits
+                        bitrate = int(stream.get('BitRate', 0) / 1000)
+                        break
+
+            date = self.parse_date(track)
+            artists_key = None
+            if track.get('ArtistItems'):
+                artists_key, track_artists = artists_of(track['ArtistItems'])
             else:
-                name = f'[] - {name}'
-
-        for source in track.get('MediaSources', []):
-            for stream in source.get('MediaStreams', []):
-                if stream.get('Type') == 'Audio':
-                    # Server returns bitrate in bits/sec, we need kbits
-                    bitrate = int(stream.get('BitRate', 0) / 1000)
-                    break
-
-        return models.Track(
-            uri='jellyfin:track:{}'.format(track.get('Id')),
-            name=name,
-            bitrate=bitrate,
-            track_no=track.get('IndexNumber', 0) if track.get('IndexNumber', 0) >= 0 else 0,
-            disc_no=track.get('ParentIndexNumber'),
-            genre=','.join(track.get('Genres', [])),
-            artists=self.create_artists(track),
-            album=self.create_album(track),
-            length=self.ticks_to_milliseconds(track.get('RunTimeTicks', 0)),
-            date=self.parse_date(track)
-        )
+                track_artists = self.create_artists(track)
+
+            if item_type == 'Audio':
+                # Same as create_album, without parsing the date again
+                if track.get('AlbumArtists'):
+                    artists_key, album_artists = artists_of(
+                        track['AlbumArtists'])
+                else:
+                    album_artists = track_artists
+                key = (track.get('AlbumId'), track.get('Album'),
+                       artists_key, date)
+                album = albums.get(key) if artists_key is not None else None
+                if album is None:
+                    album = flyweights.album(
+                        track.get('AlbumId'), track.get('Album'),
+                        album_artists, date)
+                    if artists_key is not None:
+                        albums[key] = album
+            else:
+                album = self.create_album(track)
+
+            index = track.get('IndexNumber', 0)
+            records.append(TrackRecord(
+                track.get('Id'),
+                name,
+                bitrate=bitrate,
+                track_no=index if index >= 0 else 0,
+                disc_no=track.get('ParentIndexNumber'),
+                genre=','.join(track.get('Genres', ())),
+                length=self.ticks_to_milliseconds(
+                    track.get('RunTimeTicks', 0)),
+                date=date,
+                artists=track_artists,
+                album=album
+            ))
+
+        return records
 
     def create_album(self, item):
         """Create album object from Jellyfin item.
 
+        Albums are shared between all tracks of the album.
+
         :param track: item
         :type track: dict
         :returns: Album
@@ -602,23 +986,35 @@ class JellyfinHandler(object):
         """
         item_type = item.get('Type')
         if item_type == 'Audio':
-            return models.Album(
-                name=item.get('Album'),
-                artists=self.create_artists(item),
-                uri=f'jellyfin:album:{item.get("AlbumId")}',
-                date=self.parse_date(item)
+            return flyweights.album(
+                item.get('AlbumId'),
+                item.get('Album'),
+                self._album_artists(item),
+                self.parse_date(item)
             )
         elif item_type == 'MusicAlbum':
-            return models.Album(
-                name=item.get('Name'),
-                artists=self.create_artists(item),
-                uri=f'jellyfin:album:{item.get("Id")}',
-                date=self.parse_date(item)
+            return flyweights.album(
+                item.get('Id'),
+                item.get('Name'),
+                self._album_artists(item),
+                self.parse_date(item)
             )
 
+    def _album_artists(self, item):
+        # The album artists are the same for every track of an album
+        album_artists = item.get('AlbumArtists')
+        if album_artists:
+            return [
+                flyweights.artist(artist.get('Id'), artist.get('Name'))
+                for artist in album_artists
+            ]
+        return self.create_artists(item)
+
     def create_artists(self, item={}, name=None):
         """Create artist object from jellyfin item.
 
+        Artists are shared between all tracks and albums of the artist.
+
         :param track: item
         :type track: dict
         :param name: Name
@@ -629,12 +1025,15 @@ class JellyfinHandler(object):
         item_type = item.get('Type', '')
         if item_type == 'MusicArtist':
             # Artists have a slightly different structure
+            return [flyweights.artist(item.get('Id'), item.get('Name'))]
+        elif item.get('ArtistItems'):
+            # For tracks and albums
             return [
-                models.Artist(name=item.get('Name'),
-                              uri=f'jellyfin:artist:{item.get("Id")}')
+                flyweights.artist(artist.get('Id'), artist.get('Name'))
+                for artist in item.get('ArtistItems')
             ]
         elif item_type:
-            # For tracks and albums
+            # Only the names are known
             return [
                 models.Artist(name=artist, uri=f'jellyfin:artist:{item.get("Id")}')
                 for artist in item.get('Artists', [])
@@ -643,7 +1042,80 @@ class JellyfinHandler(object):
             # In case we only get a name
             return [ models.Artist(name=name) ]
 
-    @cache()
+    def get_items(self, ids):
+        '''
+        Gets several items at once, returns a dict of the items found keyed
+        by id.  Items that aren't cached yet are requested IDS_PER_QUERY at
+        a time and added to the get_item cache
+        '''
+        items = {}
+        missing = []
+        mirror = self._mirror()
+        for item_id in dict.fromkeys(ids):
+            item = mirror.get(item_id) if mirror else None
+            if item is None:
+                item = self.get_item.cached(self, item_id)
+            if item is None:
+                missing.append(item_id)
+            else:
+                items[item_id] = item
+
+        url_params = self._fields('track')
+        chunks = [
+            missing[start:start + IDS_PER_QUERY]
+            for start in range(0, len(missing), IDS_PER_QUERY)]
+        for data in self.http.gather(
+                functools.partial(self.http.get, self.api_url(
+                    f'/Users/{self.user_id}/Items',
+                    dict(url_params, Ids=','.join(chunk))))
+                for chunk in chunks):
+            for item in data.get('Items', []):
+                self.get_item.prime(item, self, item.get('Id'))
+                items[item.get('Id')] = item
+
+        return items
+
+    def get_tracks(self, track_ids):
+        '''
+        Gets several tracks at once, returns a dict of the tracks found
+        keyed by id
+        '''
+        items = self.get_items(track_ids)
+        tracks = dict(zip(items, self.create_tracks(list(items.values()))))
+        for item_id, track in tracks.items():
+            self.get_track.prime(track, self, item_id)
+
+        return tracks
+
+    def lookup_albums(self, album_ids):
+        '''
+        Gets the tracks of several albums at once, returns a dict of track
+        lists keyed by album id
+        '''
+        albums = self._group_tracks(
+            album_ids, self._get_album_tracks,
+            lambda track: [track.get('AlbumId')])
+
+        return {
+            album_id: sorted(
+                self.create_tracks(albums[album_id]),
+                key=lambda k: (k.track_no, k.name))
+            for album_id in album_ids}
+
+    def lookup_artists(self, artist_ids):
+        '''
+        Gets the tracks of several artists at once, returns a dict of track
+        lists keyed by artist id
+        '''
+        artists = self._group_tracks(
+            artist_ids, self._get_artist_tracks, self._track_artist_ids)
+
+        return {
+            artist_id: self.create_tracks(
+                self._sort_artist_tracks(artists[artist_id]))
+            for artist_id in artist_ids}
+
+    @cache(maxsize=5000, persist=True, max_stale=86400)
     def get_track(self, track_id):
         """Get track.
 
@@ -687,7 +1159,7 @@ class JellyfinHandler(object):
 
         return list(data.get('SearchHints', []))
 
-    @cache()
+    @cache(maxsize=128, aggregate=True)
     def search(self, query):
         """Search Jellyfin for a term.
 
@@ -732,7 +1204,7 @@ class JellyfinHandler(object):
         )
 
 
-    @cache()
+    @cache(maxsize=128, aggregate=True)
     def exact_search(self, query):
         # Variable prep
         tracks = []
@@ -761,7 +1233,7 @@ class JellyfinHandler(object):
                 'IncludeItemTypes': 'MusicAlbum',
                 'Recursive': 'true',
                 'UserId': self.user_id,
-                'fields': 'MediaSources'
+                **self._fields('browse')
             }
 
             # Get album list
@@ -787,22 +1259,19 @@ class JellyfinHandler(object):
 
             # Get artist tracks
             url_params['IncludeItemTypes'] = 'Audio'
+            url_params.update(self._fields('track'))
             track_url = self.api_url('/Items', url_params)
             track_data = self.http.get(track_url)
             if track_data:
                 # If the query has an album, only match those tracks
                 if query.get('album'):
-                    tracks = [
-                        self.create_track(track)
-                        for track in track_data.get('Items')
+                    tracks = self.create_tracks([
+                        track for track in track_data.get('Items')
                         if track.get('Album') == query.get('album')[0]
-                    ]
+                    ])
                 # Otherwise return all tracks
                 else:
-                    tracks = [
-                        self.create_track(track)
-                        for track in track_data.get('Items')
-                    ]
+                    tracks = self.create_tracks(track_data.get('Items'))
 
         # Use if query only has an album name
         elif 'album' in query:
@@ -812,7 +1281,7 @@ class JellyfinHandler(object):
                 'IncludeMedia': 'true',
                 'Recursive': 'true',
                 'searchTerm': album_name,
-                'fields': 'MediaSources'
+                **self._fields('browse')
             }
             url = self.api_url('/Users/{}/Items'.format(self.user_id), url_params)
             album_data = self.http.get(url).get('Items')
@@ -830,8 +1299,7 @@ class JellyfinHandler(object):
                     if album_obj not in albums:
                         albums.append(album_obj)
                     raw_tracks = self.get_directory(album.get('Id'))
-                    tracks += [self.create_track(track)
-                               for track in raw_tracks.get('Items', [])]
+                    tracks += self.create_tracks(raw_tracks.get('Items', []))
 
         return models.SearchResult(
             uri='jellyfin:search',
@@ -840,7 +1308,7 @@ class JellyfinHandler(object):
             artists=artist_ref,
         )
 
-    @cache()
+    @cache(maxsize=256, aggregate=True)
     def get_search_tracks(self, artist_ref, album_id):
         tracks = []
 
@@ -849,7 +1317,7 @@ class JellyfinHandler(object):
             'Recursive': 'true',
             'AlbumIds': album_id,
             'UserId': self.user_id,
-            'fields': 'MediaSources'
+            **self._fields('track')
         }
         url = self.api_url('/Items', url_params)
 
@@ -860,18 +1328,14 @@ class JellyfinHandler(object):
         if artist_ref:
             # If the artist was in the query,
             # ensure all tracks belong to that artist
-            tracks = [
-                self.create_track(track)
-                for track in raw_tracks
+            tracks = self.create_tracks([
+                track for track in raw_tracks
                 if unidecode(artist_ref[0].name.lower()) in (
                     artist.lower() for artist in track.get('Artists'))
-            ]
+            ])
         else:
             # If the query doesn't contain an artist, return all tracks
-            tracks = [
-                self.create_track(track)
-                for track in raw_tracks
-            ]
+            tracks = self.create_tracks(raw_tracks)
 
         return tracks
 
@@ -884,32 +1348,58 @@ class JellyfinHandler(object):
             return item.get('Name')
 
 
-    def lookup_artist(self, artist_id):
-        """Lookup all artist tracks and sort them.
+    def _get_album_tracks(self, album_ids, mirror=None):
+        # List of all tracks of one or more comma separated albums
+        if mirror:
+            return mirror.tracks_in_album(album_ids)
+
+        url_params = {
+            'SortOrder': 'Ascending',
+            'SortBy': 'SortName',
+            'Recursive': 'true',
+            'IncludeItemTypes': 'Audio',
+            'AlbumIds': album_ids,
+            **self._fields('track')
+        }
+
+        return self.get_paged(f'/Users/{self.user_id}/Items', url_params)
+
+    def _get_artist_tracks(self, artist_id, mirror=None):
+        # List of all tracks by one or more comma separated artists
+        if mirror:
+            return mirror.tracks_by_artist(artist_id, self.albumartistsort)
 
-        :param artist_id: Artist ID
-        :type artist_id: int
-        :returns: List of tracks
-        :rtype: list
-        """
         url_params = {
             'SortOrder': 'Ascending',
             'SortBy': 'SortName',
             'Recursive': 'true',
             'IncludeItemTypes': 'Audio',
-            'fields': 'MediaSources'
+            **self._fields('track')
         }
         if self.albumartistsort:
             url_params['AlbumArtistIds'] = artist_id
         else:
             url_params['ArtistIds'] = artist_id
 
-        url = self.api_url('/Users/{}/Items'.format(self.user_id), url_params)
-        items = self.http.get(url)
+        return self.get_paged(f'/Users/{self.user_id}/Items', url_params)
+
+    def lookup_artist(self, artist_id):
+        """Lookup all artist tracks and sort them.
+
+        :param artist_id: Artist ID
+        :type artist_id: int
+        :returns: List of tracks
+        :rtype: list
+        """
+        items = self._get_artist_tracks(artist_id, self._mirror())
+
+        return self.create_tracks(self._sort_artist_tracks(items))
 
+    @staticmethod
+    def _sort_artist_tracks(items):
         # sort tracks into album keys
         album_dict = defaultdict(list)
-        for track in items.get('Items'):
+        for track in items:
             album_dict[track.get('Album')].append(track)
 
         # order albums in alphabet
@@ -925,7 +1415,7 @@ class JellyfinHandler(object):
             # add tracks to list
             tracks.extend(track_list)
 
-        return [self.create_track(i) for i in tracks]
+        return tracks
 
     @staticmethod
     def ticks_to_milliseconds(ticks):
@@ -949,16 +1439,75 @@ class JellyfinHandler(object):
         """
         return milliseconds * 10000
 
-    def get_image(self, item_id):
-        url = f'{self.hostname}/Items/{item_id}/Images/Primary'
-        # Verify if image exists instead of returning bad URLs
-        image = self.http.head(item_id, url)
-        if image:
-            return models.Image(
-                uri=url,
-            )
-        else:
-            return []
+    def get_images(self, ids):
+        '''
+        Returns the primary image of several items as a dict of image lists
+        keyed by id.  Urls are built from the image tags of the items, the
+        tags that aren't known yet are requested IDS_PER_QUERY at a time
+        '''
+        tags = {}
+        missing = []
+        mirror = self._mirror()
+        for item_id in dict.fromkeys(ids):
+            tag = self.get_image_tag.cached(self, item_id)
+            item = mirror.get(item_id) if mirror and tag is None else None
+            if item is not None and 'ImageTags' in item:
+                tag = self._image_tag(item)
+                self.get_image_tag.prime(tag, self, item_id)
+            if tag is None:
+                missing.append(item_id)
+            else:
+                tags[item_id] = tag
+
+        chunks = [
+            missing[start:start + IDS_PER_QUERY]
+            for start in range(0, len(missing), IDS_PER_QUERY)]
+        for chunk, found in zip(chunks, self.http.gather(
+                functools.partial(self._get_image_tags, chunk)
+                for chunk in chunks)):
+            for item_id in chunk:
+                # Items without artwork are remembered as well
+                tags[item_id] = found.get(item_id, [])
+                self.get_image_tag.prime(tags[item_id], self, item_id)
+
+        return {
+            item_id: [models.Image(uri=self._image_url(*tag))] if tag else []
+            for item_id, tag in tags.items()
+        }
+
+    @cache(maxsize=5000, persist=True)
+    def get_image_tag(self, item_id):
+        return self._get_image_tags([item_id]).get(item_id, [])
+
+    def _get_image_tags(self, ids):
+        # Image tags of several items, keyed by item id
+        url_params = dict(self._fields('image'), Ids=','.join(ids))
+        data = self.http.get(
+            self.api_url(f'/Users/{self.user_id}/Items', url_params))
+
+        return {
+            item.get('Id'): self._image_tag(item)
+            for item in data.get('Items', [])
+        }
+
+    @staticmethod
+    def _image_tag(item):
+        # Id and tag of the item's primary image, falling back to the album
+        # artwork for tracks
+        tag = (item.get('ImageTags') or {}).get('Primary')
+        if tag:
+            return [item.get('Id'), tag]
+        if item.get('AlbumPrimaryImageTag') and item.get('AlbumId'):
+            return [item.get('AlbumId'), item.get('AlbumPrimaryImageTag')]
+        return []
+
+    def _image_url(self, item_id, tag):
+        # The tag changes with the image, so clients can cache the url
+        if self.image_proxy:
+            return f'{PROXY_PATH}/{item_id}/{tag}'
+
+        params = urlencode(dict(self.image_params, tag=tag))
+        return f'{self.hostname}/Items/{item_id}/Images/Primary?{params}'
 
     def parse_date(self, item):
         """
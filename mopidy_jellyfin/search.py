@@ -0,0 +1,200 @@
+from __future__ import unicode_literals
+
+import bisect
+import logging
+import re
+import threading
+from collections import defaultdict
+
+from mopidy import models
+from unidecode import unidecode
+
+from mopidy_jellyfin.records import as_model
+
+logger = logging.getLogger(__name__)
+
+# Item fields searched for each Mopidy query field
+QUERY_FIELDS = {
+    'any': ('name', 'artist', 'albumartist', 'album'),
+    'artist': ('artist',),
+    'albumartist': ('albumartist',),
+    'album': ('album',),
+    'track_name': ('name',),
+    'genre': ('genre',),
+    'date': ('date',),
+}
+
+# Query fields that only make sense for a single item type
+QUERY_TYPES = {
+    'track_name': 'Audio',
+    'genre': 'Audio',
+}
+
+_WORDS = re.compile(r'\w+')
+
+
+def tokenize(text):
+    '''
+    Splits text into lowercase ascii words so that searching for
+    "bjork" finds "Björk"
+    '''
+    if not text:
+        return []
+    return _WORDS.findall(unidecode(str(text)).casefold())
+
+
+class SearchIndex(object):
+    '''
+    Inverted index over the music libraries, used to answer searches
+    without going to the server.  Every word of a search term has to
+    match, each as the prefix of a word in the item.
+    '''
+
+    def __init__(self, limit=250):
+        self.limit = limit
+        self.ready = False
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._types = {}
+        self._order = {}
+        self._postings = defaultdict(set)
+        self._doc_tokens = {}
+        self._sorted = {}
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    @staticmethod
+    def _fields(item):
+        # Searchable text of a Jellyfin item, per field
+        item_type = item.get('Type')
+        fields = {
+            'genre': item.get('Genres', []),
+            'date': [item.get('ProductionYear')],
+        }
+        if item_type == 'Audio':
+            fields['name'] = [item.get('Name')]
+            fields['artist'] = item.get('Artists', [])
+            fields['albumartist'] = [item.get('AlbumArtist')]
+            fields['album'] = [item.get('Album')]
+        elif item_type == 'MusicAlbum':
+            fields['name'] = fields['album'] = [item.get('Name')]
+            fields['artist'] = item.get('Artists', [])
+            fields['albumartist'] = [item.get('AlbumArtist')]
+        elif item_type == 'MusicArtist':
+            fields['name'] = fields['artist'] = [item.get('Name')]
+
+        return fields
+
+    def add(self, item, model):
+        '''
+        Indexes a Jellyfin item, searches return the given model for it
+
+        :param item: Item from the Jellyfin API
+        :type item: dict
+        :param model: Track record, Album or Artist built from the item
+        :type model: mopidy.models.ImmutableObject or TrackRecord
+        '''
+        item_id = item.get('Id')
+        tokens = set()
+        for field, values in self._fields(item).items():
+            for value in values:
+                tokens.update((field, token) for token in tokenize(value))
+
+        with self._lock:
+            self.remove(item_id)
+            self._counter += 1
+            self._docs[item_id] = model
+            self._types[item_id] = item.get('Type')
+            self._order[item_id] = self._counter
+            self._doc_tokens[item_id] = tokens
+            for token in tokens:
+                self._postings[token].add(item_id)
+                self._sorted.pop(token[0], None)
+
+    def remove(self, item_id):
+        with self._lock:
+            for token in self._doc_tokens.pop(item_id, ()):
+                postings = self._postings[token]
+                postings.discard(item_id)
+                if not postings:
+                    del self._postings[token]
+                    self._sorted.pop(token[0], None)
+            self._docs.pop(item_id, None)
+            self._types.pop(item_id, None)
+            self._order.pop(item_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+            self._types.clear()
+            self._order.clear()
+            self._postings.clear()
+            self._doc_tokens.clear()
+            self._sorted.clear()
+
+    def _tokens(self, field):
+        # Sorted words of a field, rebuilt after the index changes
+        words = self._sorted.get(field)
+        if words is None:
+            words = sorted(
+                token for f, token in self._postings if f == field)
+            self._sorted[field] = words
+        return words
+
+    def _match_word(self, fields, word):
+        # Ids of items with a word starting with the given word
+        matches = set()
+        for field in fields:
+            words = self._tokens(field)
+            start = bisect.bisect_left(words, word)
+            for token in words[start:]:
+                if not token.startswith(word):
+                    break
+                matches |= self._postings[(field, token)]
+        return matches
+
+    @staticmethod
+    def supports(query):
+        # Whether every field of a query can be answered from the index
+        return all(field in QUERY_FIELDS for field in query)
+
+    def search(self, query):
+        '''
+        Searches the index
+
+        :param query: Mopidy search query
+        :type query: dict
+        :returns: Search results
+        :rtype: mopidy.models.SearchResult
+        '''
+        with self._lock:
+            matches = None
+            item_type = None
+            for field, terms in query.items():
+                fields = QUERY_FIELDS.get(field)
+                if fields is None:
+                    logger.debug(f'Jellyfin: Unsupported search field {field}')
+                    continue
+                item_type = QUERY_TYPES.get(field, item_type)
+                for term in terms:
+                    for word in tokenize(term):
+                        found = self._match_word(fields, word)
+                        matches = found if matches is None else matches & found
+
+            results = {'Audio': [], 'MusicAlbum': [], 'MusicArtist': []}
+            for item_id in sorted(matches or (), key=self._order.get):
+                doc_type = self._types[item_id]
+                if item_type and doc_type != item_type:
+                    continue
+                found = results.get(doc_type)
+                if found is not None and len(found) < self.limit:
+                    found.append(self._docs[item_id])
+
+        return models.SearchResult(
+            uri='jellyfin:search',
+            tracks=[as_model(track) for track in results['Audio']],
+            albums=results['MusicAlbum'],
+            artists=results['MusicArtist']
+        )
@@ -0,0 +1,254 @@
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from mopidy import models
+
+logger = logging.getLogger(__name__)
+
+# Item ids per query when deleting the entries that mention them, well
+# below SQLite's limit on query parameters
+IDS_PER_QUERY = 500
+
+
+class MetadataStore(object):
+    '''
+    Persistent key/value store for server responses, kept in an SQLite
+    database under the extension cache dir so a restart doesn't begin with
+    an empty cache.  Values are anything json serializable, including
+    mopidy models.
+    '''
+
+    # Bump whenever the table layout or the stored data changes shape
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._conn = None
+        self._open()
+
+    def _open(self):
+        try:
+            self._connect()
+        except sqlite3.DatabaseError as e:
+            self._recover(e)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                # Stored data from another version can't be trusted
+                logger.debug(
+                    f'Jellyfin: Resetting metadata cache version {version}')
+                conn.execute('DROP TABLE IF EXISTS entries')
+                conn.execute('DROP TABLE IF EXISTS entry_items')
+                conn.execute(
+                    'CREATE TABLE entries ('
+                    'namespace TEXT NOT NULL, '
+                    'key TEXT NOT NULL, '
+                    'value TEXT NOT NULL, '
+                    'updated REAL NOT NULL, '
+                    'PRIMARY KEY (namespace, key))'
+                )
+                # The strings in each key, so entries can be looked up by
+                # the item ids they were requested for
+                conn.execute(
+                    'CREATE TABLE entry_items ('
+                    'item_id TEXT NOT NULL, '
+                    'namespace TEXT NOT NULL, '
+                    'key TEXT NOT NULL, '
+                    'PRIMARY KEY (item_id, namespace, key)) WITHOUT ROWID'
+                )
+                conn.execute(
+                    'CREATE INDEX entry_items_entries '
+                    'ON entry_items (namespace, key)'
+                )
+                conn.execute(f'PRAGMA user_version={self.SCHEMA_VERSION}')
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+
+        self._conn = conn
+
+    def _recover(self, error):
+        # Throw away a damaged database and start over with an empty one
+        logger.warning(
+            f'Jellyfin: Metadata cache is unusable, resetting: {error}')
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.path + suffix)
+            except OSError:
+                pass
+
+        self._connect()
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            try:
+                return self._conn.execute(query, params).fetchall()
+            except sqlite3.DatabaseError as e:
+                self._recover(e)
+                return []
+
+    def _write(self, queries):
+        # Runs (query, rows) pairs with executemany in one transaction
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute('BEGIN')
+                    for query, rows in queries:
+                        self._conn.executemany(query, rows)
+            except sqlite3.DatabaseError as e:
+                self._recover(e)
+
+    @staticmethod
+    def _encode_key(key):
+        return json.dumps(key, sort_keys=True, cls=models.ModelJSONEncoder)
+
+    @classmethod
+    def _key_items(cls, key):
+        # Strings in a key, any of them may be an item id
+        if isinstance(key, str):
+            return {key}
+        if isinstance(key, dict):
+            key = key.values()
+        elif not isinstance(key, (list, tuple, set, frozenset)):
+            return set()
+        return set().union(*[cls._key_items(part) for part in key])
+
+    def _set_queries(self, namespace, pairs):
+        now = time.time()
+        entries = []
+        items = []
+        for key, value in pairs:
+            encoded = self._encode_key(key)
+            entries.append((
+                namespace, encoded,
+                json.dumps(value, cls=models.ModelJSONEncoder), now))
+            items.extend(
+                (item_id, namespace, encoded)
+                for item_id in self._key_items(key))
+
+        return [
+            ('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', entries),
+            ('INSERT OR IGNORE INTO entry_items VALUES (?, ?, ?)', items),
+        ]
+
+    @staticmethod
+    def _delete_queries(rows):
+        # rows are (namespace, encoded key) pairs
+        return [
+            ('DELETE FROM entries WHERE namespace=? AND key=?', rows),
+            ('DELETE FROM entry_items WHERE namespace=? AND key=?', rows),
+        ]
+
+    def get(self, namespace, key, max_age=None):
+        '''
+        Returns the stored value if it is younger than max_age seconds,
+        otherwise None
+        '''
+        return self.get_entry(namespace, key, max_age)[0]
+
+    def get_entry(self, namespace, key, max_age=None):
+        '''
+        Like get, but returns the value along with the time it was stored,
+        or (None, None)
+        '''
+        if max_age is None:
+            max_age = self.ttl
+        rows = self._execute(
+            'SELECT value, updated FROM entries WHERE namespace=? AND key=?',
+            (namespace, self._encode_key(key))
+        )
+        if not rows:
+            return None, None
+
+        value, updated = rows[0]
+        if time.time() - updated > max_age:
+            return None, None
+
+        try:
+            return json.loads(
+                value, object_hook=models.model_json_decoder), updated
+        except ValueError:
+            self.delete(namespace, key)
+            return None, None
+
+    def set(self, namespace, key, value):
+        self._write(self._set_queries(namespace, [(key, value)]))
+
+    def set_many(self, namespace, values):
+        # Store every key/value pair of a dict in one transaction
+        self._write(self._set_queries(namespace, values.items()))
+
+    def get_all(self, namespace):
+        '''
+        Returns every entry of a namespace as a dict, regardless of age
+        '''
+        rows = self._execute(
+            'SELECT key, value FROM entries WHERE namespace=?', (namespace,))
+        try:
+            return {
+                json.loads(key): json.loads(
+                    value, object_hook=models.model_json_decoder)
+                for key, value in rows
+            }
+        except ValueError:
+            self.delete(namespace)
+            return {}
+
+    def delete(self, namespace, key=None):
+        # Remove a single entry, or the whole namespace if no key is given
+        if key is None:
+            self._write([
+                ('DELETE FROM entries WHERE namespace=?', [(namespace,)]),
+                ('DELETE FROM entry_items WHERE namespace=?', [(namespace,)]),
+            ])
+        else:
+            self.delete_many(namespace, [key])
+
+    def delete_many(self, namespace, keys):
+        self._write(self._delete_queries(
+            [(namespace, self._encode_key(key)) for key in keys]))
+
+    def delete_referencing(self, namespaces, item_ids):
+        '''
+        Removes the entries of the given namespaces whose key mentions any
+        of the item ids
+        '''
+        namespaces = set(namespaces)
+        item_ids = list(item_ids)
+        rows = set()
+        for start in range(0, len(item_ids), IDS_PER_QUERY):
+            chunk = item_ids[start:start + IDS_PER_QUERY]
+            rows.update(self._execute(
+                'SELECT namespace, key FROM entry_items WHERE item_id IN '
+                f'({",".join("?" * len(chunk))})', chunk))
+
+        rows = [row for row in rows if row[0] in namespaces]
+        if rows:
+            self._write(self._delete_queries(rows))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
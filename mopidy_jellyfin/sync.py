@@ -0,0 +1,333 @@
+from __future__ import unicode_literals
+
+import datetime
+import logging
+import threading
+
+from mopidy_jellyfin.utils import invalidate_items
+
+logger = logging.getLogger(__name__)
+
+# Item keys needed to build models and answer queries, everything else is
+# dropped to keep the mirror small
+ITEM_KEYS = (
+    'Id', 'Name', 'SortName', 'Type', 'Album', 'AlbumId', 'AlbumArtist',
+    'AlbumArtists', 'Artists', 'ArtistItems', 'IndexNumber',
+    'ParentIndexNumber', 'Genres', 'RunTimeTicks', 'PremiereDate',
+    'ProductionYear', 'DateCreated', 'UserData', 'ImageTags',
+    'AlbumPrimaryImageTag'
+)
+
+# Allowance for the clocks of the server and this machine disagreeing
+CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+# Seconds to wait before retrying a failed initial sync
+RETRY_INTERVAL = 60
+
+
+def compact_item(item):
+    '''
+    Strips a Jellyfin item down to the keys the mirror uses, only keeping
+    the bitrate of the media sources
+    '''
+    compact = {key: item[key] for key in ITEM_KEYS if key in item}
+    for source in item.get('MediaSources', []):
+        for stream in source.get('MediaStreams', []):
+            if stream.get('Type') == 'Audio':
+                compact['MediaSources'] = [{'MediaStreams': [{
+                    'Type': 'Audio', 'BitRate': stream.get('BitRate', 0)}]}]
+                return compact
+
+    return compact
+
+
+class LibrarySync(object):
+    '''
+    Keeps a local mirror of the configured music libraries.  The first run
+    crawls everything, later runs only fetch the items saved on the server
+    since the previous one and compare item counts to notice deletions.
+    The mirror is saved to the metadata store so restarts continue with
+    a delta instead of a full crawl.
+    '''
+
+    def __init__(self, remote, interval=900, index=None, store=None):
+        self.remote = remote
+        self.interval = interval
+        self.index = index
+        self.store = store
+        self.ready = threading.Event()
+        self.last_sync = None
+        self._items = {}
+        # Ids of the albums and tracks filed under each album and artist,
+        # kept along with _items so queries don't scan the whole mirror
+        self._related = {}
+        self._libraries = {}
+        self._artists = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        # Set to sync before the interval is up
+        self._wake = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='JellyfinLibrarySync')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self):
+        '''
+        Syncs right away instead of at the next interval, for when the
+        server reports library changes
+        '''
+        self._wake.set()
+
+    def _run(self):
+        self._restore()
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning(f'Jellyfin: Library sync failed: {e}')
+                if not self.ready.is_set():
+                    self._wake.wait(RETRY_INTERVAL)
+                    self._wake.clear()
+                    continue
+
+            # Without an interval only changes reported by the server are
+            # synced after the first run
+            self._wake.wait(self.interval or None)
+            self._wake.clear()
+
+    def _restore(self):
+        # Load the mirror saved by a previous run
+        if self.store is None:
+            return
+
+        state = self.store.get('sync', 'state', max_age=float('inf'))
+        if not state:
+            return
+
+        items = self.store.get_all('library')
+        with self._lock:
+            self._items = items
+            self._related = {}
+            for item in items.values():
+                self._file(item)
+            self._libraries = {
+                library_id: set(ids)
+                for library_id, ids in state['libraries'].items()
+            }
+            self._artists = state['artists']
+            self.last_sync = state['last_sync']
+
+        self._index(items.values(), ())
+        self.ready.set()
+        logger.info(f'Jellyfin: Restored {len(items)} library items')
+
+    def sync(self):
+        '''
+        Brings the mirror up to date with the server
+        '''
+        started = datetime.datetime.now(datetime.timezone.utc)
+        updated = {}
+        removed = set()
+        libraries = {}
+        artists = {}
+
+        for library_id in self.remote.get_library_ids():
+            known = self._libraries.get(library_id)
+            if known is None or self.last_sync is None:
+                # Never seen this library before, get all of it
+                items = [
+                    compact_item(item) for item in
+                    self.remote.get_library_items(library_id)
+                ]
+                ids = set(item.get('Id') for item in items)
+                gone = (known or set()) - ids
+            else:
+                items = [
+                    compact_item(item) for item in
+                    self.remote.get_library_items(library_id, self.last_sync)
+                ]
+                ids = known | set(item.get('Id') for item in items)
+                gone = set()
+                if self.remote.get_library_count(library_id) != len(ids):
+                    # Something was deleted, find out what
+                    gone = ids - self.remote.get_library_item_ids(library_id)
+                    ids -= gone
+
+            updated.update((item.get('Id'), item) for item in items)
+            removed |= gone
+            libraries[library_id] = ids
+
+            if known is None or items or gone:
+                # Artists only change along with their albums and tracks
+                library_artists = [
+                    compact_item(artist) for artist in
+                    self.remote.fetch_library_artists(library_id) or []
+                ]
+                artist_ids = [artist.get('Id') for artist in library_artists]
+                removed |= set(self._artists.get(library_id, [])) - set(
+                    artist_ids)
+                updated.update(
+                    (artist.get('Id'), artist) for artist in library_artists)
+                artists[library_id] = artist_ids
+            else:
+                artists[library_id] = self._artists[library_id]
+
+        # Libraries that are gone or no longer configured
+        for library_id in set(self._libraries) - set(libraries):
+            removed |= self._libraries[library_id]
+            removed |= set(self._artists.get(library_id, []))
+
+        # Refetched artists and overlapping deltas are often unchanged
+        updated = {
+            item_id: item for item_id, item in updated.items()
+            if self._items.get(item_id) != item
+        }
+        with self._lock:
+            for item_id, item in updated.items():
+                self._unfile(self._items.get(item_id))
+                self._file(item)
+            self._items.update(updated)
+            for item_id in removed:
+                self._unfile(self._items.pop(item_id, None))
+            self._libraries = libraries
+            self._artists = artists
+            self.last_sync = (started - CLOCK_SKEW).strftime(
+                '%Y-%m-%dT%H:%M:%SZ')
+
+        self._index(updated.values(), removed)
+        if self.ready.is_set() and (updated or removed):
+            invalidate_items(set(updated) | removed, aggregate=True)
+        self._save(updated, removed)
+        self.ready.set()
+
+        logger.debug(
+            f'Jellyfin: Library sync updated {len(updated)} and '
+            f'removed {len(removed)} items')
+
+    def _index(self, items, removed):
+        if self.index is None:
+            return
+
+        for item_id in removed:
+            self.index.remove(item_id)
+
+        items = list(items)
+        # Tracks are only turned into models when they're found, the
+        # records are built in one batch
+        records = iter(self.remote.create_records(
+            [item for item in items if item.get('Type') == 'Audio']))
+        for item in items:
+            if item.get('Type') == 'Audio':
+                self.index.add(item, next(records))
+            else:
+                self.index.add(item, self.remote.create_model(item))
+        self.index.ready = True
+
+    def _save(self, updated, removed):
+        if self.store is None:
+            return
+
+        self.store.set_many('library', updated)
+        self.store.delete_many('library', removed)
+        self.store.set('sync', 'state', {
+            'last_sync': self.last_sync,
+            'libraries': {
+                library_id: sorted(ids)
+                for library_id, ids in self._libraries.items()
+            },
+            'artists': self._artists,
+        })
+
+    def get(self, item_id):
+        return self._items.get(item_id)
+
+    def has_library(self, library_id):
+        return library_id in self._libraries
+
+    @staticmethod
+    def _related_keys(item):
+        # Keys an album or track is filed under in _related
+        if item.get('Type') not in ('MusicAlbum', 'Audio'):
+            return
+        if item.get('AlbumId'):
+            yield 'album', item.get('AlbumId')
+        for artist in item.get('AlbumArtists', []):
+            yield 'album_artist', artist.get('Id')
+            yield 'album_artist_name', artist.get('Name')
+        for artist in item.get('ArtistItems', []):
+            yield 'artist', artist.get('Id')
+        for name in item.get('Artists', []):
+            yield 'artist_name', name
+
+    def _file(self, item):
+        for key in self._related_keys(item):
+            self._related.setdefault(key, set()).add(item.get('Id'))
+
+    def _unfile(self, item):
+        if item is None:
+            return
+        for key in self._related_keys(item):
+            ids = self._related.get(key)
+            if ids is not None:
+                ids.discard(item.get('Id'))
+                if not ids:
+                    del self._related[key]
+
+    def _select(self, match):
+        # Items matching a filter, sorted the way the server sorts them
+        with self._lock:
+            items = [item for item in self._items.values() if match(item)]
+        return sorted(items, key=lambda i: i.get('SortName') or '')
+
+    def _filed(self, item_type, *keys):
+        # Items of a type filed under any of the keys, sorted like _select
+        with self._lock:
+            ids = set()
+            for key in keys:
+                ids |= self._related.get(key, set())
+            items = [
+                self._items[i] for i in sorted(ids)
+                if self._items[i].get('Type') == item_type
+            ]
+        return sorted(items, key=lambda i: i.get('SortName') or '')
+
+    def artists(self, library_id=None):
+        with self._lock:
+            if library_id is None:
+                ids = [i for ids in self._artists.values() for i in ids]
+            else:
+                ids = self._artists.get(library_id, [])
+            return [self._items[i] for i in ids if i in self._items]
+
+    def albums(self):
+        return self._select(lambda item: item.get('Type') == 'MusicAlbum')
+
+    @staticmethod
+    def _artist_keys(kind, value, album_artist):
+        keys = [(f'album_{kind}', value)]
+        if not album_artist:
+            keys.append((kind, value))
+        return keys
+
+    def albums_by_artist(self, artist_id, album_artist=True):
+        return self._filed(
+            'MusicAlbum',
+            *self._artist_keys('artist', artist_id, album_artist))
+
+    def albums_by_artist_name(self, name, album_artist=True):
+        return self._filed(
+            'MusicAlbum',
+            *self._artist_keys('artist_name', name, album_artist))
+
+    def tracks_by_artist(self, artist_id, album_artist=True):
+        return self._filed(
+            'Audio', *self._artist_keys('artist', artist_id, album_artist))
+
+    def tracks_in_album(self, album_id):
+        return self._filed('Audio', ('album', album_id))
@@ -1,41 +1,582 @@
 from __future__ import unicode_literals
 
+import bisect
+import functools
 import logging
+import threading
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 logger = logging.getLogger(__name__)
 
+# Every cache created by the decorator, keyed by the decorated function name
+caches = {}
+
+# The decorator instances behind `caches`, used for invalidation
+_decorators = {}
+
+# Optional MetadataStore backing the caches created with persist=True
+persistent_store = None
+
+# Marks frozen dicts so they never collide with a tuple of pairs
+_DICT = object()
+
+# Seconds an old copy used in place of a failed request is kept, so the
+# server is asked again soon after it recovers
+FALLBACK_TTL = 60
+
+# Refreshes stale entries in the background, created on first use
+_refresher = None
+_refresher_lock = threading.Lock()
+
+# Marks the thread refreshing a stale entry.  Cached calls made by the
+# refresh treat stale entries as misses, otherwise the refreshed result
+# could be built from data older than max_stale allows
+_refreshing = threading.local()
+
+
+def _in_refresh():
+    return getattr(_refreshing, 'active', False)
+
+
+def bind_refresh(func):
+    '''
+    Wraps func so cached calls it makes on another thread know whether the
+    calling thread is refreshing a stale entry
+    '''
+    active = _in_refresh()
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        previous = _in_refresh()
+        _refreshing.active = active
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _refreshing.active = previous
+
+    return run
+
+
+def _background(func, *args):
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix='JellyfinCacheRefresh')
+
+    return _refresher.submit(func, *args)
+
+
+def make_key(value):
+    '''
+    Converts nested dicts, lists and sets into an equivalent hashable value
+    so calls taking Jellyfin query dicts can be used as cache keys
+    '''
+    if isinstance(value, dict):
+        items = sorted(value.items(), key=lambda i: str(i[0]))
+        return (_DICT,) + tuple((k, make_key(v)) for k, v in items)
+    elif isinstance(value, (list, tuple)):
+        return tuple(make_key(v) for v in value)
+    elif isinstance(value, (set, frozenset)):
+        return frozenset(make_key(v) for v in value)
+
+    return value
+
+
+class _Expiring(object):
+    # Loader result that expires sooner than the cache's ttl, like a saved
+    # copy or an old one standing in for a failed request
+
+    def __init__(self, value, ttl):
+        self.value = value
+        self.ttl = ttl
+
+
+class _Call(object):
+    # A fetch in progress that other callers can wait on
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LRUCache(object):
+    '''
+    Size bounded mapping where every entry also expires after a time to
+    live.  The least recently used entry is evicted when the cache is full.
+    All access is lock protected since the backend actor and the frontend
+    threads share the same instances.
+
+    Concurrent misses on the same key through `get_or_load` only run the
+    loader once, the other callers wait for and share its result.
+
+    Expired entries are kept for another max_stale seconds.  During that
+    window `get_or_load` hands out the old value right away and reloads it
+    in the background.
+    '''
+
+    def __init__(self, maxsize=128, ttl=3600, max_stale=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.collapsed = 0
+        self.stale_hits = 0
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True):
+        # Returns a fresh value for the key, or the default if it's missing
+        with self._lock:
+            now = time.time()
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry[0]
+
+            if entry is not None and entry[1] + self.max_stale <= now:
+                # Too old to even be served stale
+                del self._data[key]
+            if count:
+                self.misses += 1
+            return default
+
+    def get_stale(self, key):
+        # Returns an expired value that is still within max_stale
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] + self.max_stale > time.time():
+                return entry[0]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def get_or_load(self, key, loader, refresh=None):
+        '''
+        Returns the cached value for the key, calling the loader on a miss.
+        Only one loader runs per key at a time.  Stale entries are reloaded
+        with refresh if it's given, otherwise with the loader.
+        '''
+        with self._lock:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            stale = None
+            if self.max_stale and not _in_refresh():
+                stale = self.get_stale(key)
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            elif stale is None:
+                self.collapsed += 1
+
+        if stale is not None:
+            self.stale_hits += 1
+            if leader:
+                _background(self._refresh, key, refresh or loader, call)
+            return stale
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        value = self._load(key, loader, call)
+        if value is not None and self.max_stale and key not in self:
+            # The loader found an expired copy, like one saved before a
+            # restart, which is served while it's refreshed
+            self.stale_hits += 1
+            self._revalidate(key, refresh or loader)
+        return value
+
+    def _revalidate(self, key, loader):
+        # Reloads an expired entry in the background, unless that's underway
+        with self._lock:
+            if key in self._inflight:
+                return
+            call = self._inflight[key] = _Call()
+        _background(self._refresh, key, loader, call)
+
+    def _load(self, key, loader, call):
+        try:
+            value = loader()
+            ttl = None
+            if isinstance(value, _Expiring):
+                # Negative for copies that expired already
+                ttl = min(self.ttl, value.ttl)
+                value = value.value
+            call.value = value
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+
+    def _refresh(self, key, loader, call):
+        _refreshing.active = True
+        try:
+            self._load(key, loader, call)
+        except Exception as e:
+            logger.info(f'Jellyfin: Failed to refresh cached data: {e}')
+        finally:
+            _refreshing.active = False
+
+    def invalidate(self, predicate):
+        # Drops every entry whose key matches the predicate
+        with self._lock:
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                del self._data[key]
+
+        return len(stale)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[0] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'collapsed': self.collapsed,
+                'stale_hits': self.stale_hits,
+            }
+
+    def _evict(self):
+        # Drop the least recently used entries until we're within budget
+        while self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
 
 class cache(object):
-    # stolen from mopidy-soundcloud <3
+    '''
+    Memoizes the decorated function in an LRUCache.  Each decorated
+    function gets its own cache, registered in `caches` under the function
+    name so the size and ttl can be tuned from the config.
+
+    Arguments are turned into a key with `make_key` unless a `key`
+    function is given, which receives the same arguments as the call.
+
+    With persist=True, misses are looked up in `persistent_store` before
+    calling the function and results are written back to it.  A saved
+    result is fresh while it is younger than the cache's ttl, after that it
+    is treated like any other expired entry.  Only use it on methods
+    returning json serializable data, the instance argument is left out of
+    the stored key.  When the function fails, an expired
+    copy from the store is returned instead if there is one.
+
+    Results that are built from many items, like listings and searches,
+    should be marked aggregate=True so they're dropped whenever items in
+    the library change.
 
-    def __init__(self, ctl=8, ttl=3600):
-        self.cache = {}
-        self.ctl = ctl
+    A max_stale of more than 0 seconds lets expired results be served while
+    they're refreshed in the background.  Refreshes always call the
+    function, never the store.
+    '''
+
+    def __init__(self, maxsize=128, ttl=3600, key=None, persist=False,
+                 aggregate=False, max_stale=0):
+        self.maxsize = maxsize
         self.ttl = ttl
-        self._call_count = 1
+        self.max_stale = max_stale
+        self.key = key or (lambda *args: make_key(args))
+        self.persist = persist
+        self.aggregate = aggregate
 
     def __call__(self, func):
-        def _memoized(*args):
-            self.func = func
-            now = time.time()
+        lru = LRUCache(self.maxsize, self.ttl, self.max_stale)
+        caches[func.__name__] = lru
+        _decorators[func.__name__] = self
+        self.name = func.__name__
+        self.lru = lru
+        make = self.key
+        persist = self.persist
+
+        def saved(args):
+            # Stored result that is fresh or may still be served stale, with
+            # the seconds it has left before expiring
+            store = persistent_store if persist else None
+            if store is None:
+                return None
+            max_age = lru.ttl if _in_refresh() else lru.ttl + lru.max_stale
+            value, updated = store.get_entry(
+                func.__name__, args[1:], max_age=max_age)
+            if value is None:
+                return None
+            return _Expiring(value, updated + lru.ttl - time.time())
+
+        def load(args, refresh=False):
+            store = persistent_store if persist else None
+            if not refresh:
+                value = saved(args)
+                if value is not None:
+                    return value
+
             try:
-                value, last_update = self.cache[args]
-                age = now - last_update
-                if self._call_count >= self.ctl or age > self.ttl:
-                    self._call_count = 1
-                    raise AttributeError
+                value = func(*args)
+            except Exception as e:
+                old = None
+                if store is not None:
+                    old = store.get(func.__name__, args[1:], float('inf'))
+                if old is None:
+                    raise
+                logger.info(
+                    f'Jellyfin: Using saved {func.__name__} result, '
+                    f'the server request failed: {e}')
+                return _Expiring(old, FALLBACK_TTL)
 
-                self._call_count += 1
-                return value
+            if store is not None and value is not None:
+                store.set(func.__name__, args[1:], value)
 
-            except (KeyError, AttributeError):
-                value = self.func(*args)
-                self.cache[args] = (value, now)
-                return value
+            return value
 
+        @functools.wraps(func)
+        def _memoized(*args):
+            try:
+                key = make(*args)
+                hash(key)
             except TypeError:
-                return self.func(*args)
+                # Unhashable arguments can't be cached
+                logger.debug(f'Jellyfin: Uncacheable call to {func.__name__}')
+                return func(*args)
+
+            return lru.get_or_load(
+                key, lambda: load(args), lambda: load(args, refresh=True))
+
+        def cached(*args):
+            # Result of an earlier call if there is one, without calling
+            value = lru.get(make(*args))
+            if value is None:
+                stored = saved(args)
+                if stored is not None and stored.ttl > 0:
+                    value = stored.value
+                    lru.set(make(*args), value, stored.ttl)
+            return value
+
+        def prime(value, *args):
+            # Stores the result of a call made some other way, like items
+            # fetched in bulk
+            lru.set(make(*args), value)
+            if persist and persistent_store is not None:
+                persistent_store.set(func.__name__, args[1:], value)
 
+        _memoized.cache = lru
+        _memoized.cached = cached
+        _memoized.prime = prime
         return _memoized
+
+
+def configure_caches(sizes=None, ttl=None, store=None, max_stale=None):
+    '''
+    Applies user overrides to the registered caches
+
+    :param sizes: Max entries keyed by decorated function name
+    :type sizes: dict
+    :param ttl: Seconds before an entry is refetched
+    :type ttl: int
+    :param store: Backing store for persistent caches
+    :type store: mopidy_jellyfin.store.MetadataStore
+    :param max_stale: Seconds expired entries may still be served, only
+        applies to caches that allow stale entries
+    :type max_stale: int
+    '''
+    global persistent_store
+    persistent_store = store
+
+    for name, size in (sizes or {}).items():
+        if name in caches:
+            caches[name].resize(size)
+        else:
+            logger.warning(f'Jellyfin: No cache named {name}')
+
+    if ttl is not None:
+        for lru in caches.values():
+            lru.ttl = ttl
+
+    if max_stale is not None:
+        for lru in caches.values():
+            if lru.max_stale:
+                lru.max_stale = max_stale
+
+
+def _references(key, item_ids):
+    # Whether any part of a cache key is one of the given item ids
+    if isinstance(key, (tuple, frozenset)):
+        return any(_references(part, item_ids) for part in key)
+
+    return isinstance(key, str) and key in item_ids
+
+
+def invalidate_items(item_ids, aggregate=False):
+    '''
+    Drops cached results that were requested for any of the given item ids,
+    in memory and on disk.  With aggregate=True, every cache marked as an
+    aggregate is emptied as well.
+
+    :param item_ids: Jellyfin item ids
+    :type item_ids: iterable of str
+    :param aggregate: Whether items were added, removed or updated
+    :type aggregate: bool
+    '''
+    item_ids = frozenset(item_ids)
+    count = 0
+    # Persisted caches whose saved entries for the items have to go
+    persisted = []
+    for name, decorator in _decorators.items():
+        store = persistent_store if decorator.persist else None
+        if aggregate and decorator.aggregate:
+            count += len(decorator.lru)
+            decorator.lru.clear()
+            if store is not None:
+                store.delete(name)
+        elif item_ids:
+            count += decorator.lru.invalidate(
+                lambda key: _references(key, item_ids))
+            if store is not None:
+                persisted.append(name)
+
+    if persisted:
+        persistent_store.delete_referencing(persisted, item_ids)
+
+    logger.debug(f'Jellyfin: Invalidated {count} cached responses')
+
+
+def parse_cache_sizes(values):
+    '''
+    Turns config entries like `get_item:5000` into a dict of sizes
+    '''
+    sizes = {}
+    for value in values or []:
+        name, _, size = value.partition(':')
+        try:
+            sizes[name.strip()] = int(size)
+        except ValueError:
+            logger.warning(f'Jellyfin: Invalid cache size {value}')
+
+    return sizes
+
+
+def cache_stats():
+    return {name: lru.stats() for name, lru in caches.items()}
+
+
+def log_cache_stats():
+    # Reports how well each cache did, to help tune cache_sizes
+    for name, stats in sorted(cache_stats().items()):
+        if stats['hits'] or stats['misses']:
+            logger.debug(
+                f'Jellyfin: Cache {name} {stats["size"]}/{stats["maxsize"]} '
+                f'entries, {stats["hits"]} hits, {stats["misses"]} misses, '
+                f'{stats["evictions"]} evictions, '
+                f'{stats["collapsed"]} collapsed, '
+                f'{stats["stale_hits"]} stale hits')
+
+
+def _longest_increasing(values):
+    # Values on one of the longest increasing runs, by patience sorting
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        position = bisect.bisect_left(tails, value)
+        if position:
+            previous[index] = tail_indexes[position - 1]
+        if position == len(tails):
+            tails.append(value)
+            tail_indexes.append(index)
+        else:
+            tails[position] = value
+            tail_indexes[position] = index
+
+    run = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        run.add(values[index])
+        index = previous[index]
+
+    return run
+
+
+def playlist_edits(curr_ids, new_ids):
+    '''
+    Works out the fewest changes turning the playlist curr_ids into new_ids.
+    Returns the indexes in curr_ids to remove, the ids to append and the
+    moves to make afterwards as (position, new_index) pairs, where position
+    is the index of the entry once removed and appended items are applied
+    and new_index is where the server should place it
+    '''
+    # The n-th occurrence of an id in both lists is the same entry
+    wanted = {}
+    for index, item_id in enumerate(new_ids):
+        wanted.setdefault(item_id, deque()).append(index)
+
+    removed = []
+    order = []
+    for index, item_id in enumerate(curr_ids):
+        if wanted.get(item_id):
+            order.append(wanted[item_id].popleft())
+        else:
+            removed.append(index)
+
+    added = sorted(index for indexes in wanted.values() for index in indexes)
+    # New index of each entry, in the order they are after appending
+    order.extend(added)
+
+    # Entries on the longest common subsequence keep their place, every
+    # other entry is moved in behind its new predecessor
+    keep = _longest_increasing(order)
+    positions = {target: position for position, target in enumerate(order)}
+    entries = list(order)
+    moves = []
+    for target in range(len(order)):
+        if target in keep:
+            continue
+        entries.remove(target)
+        new_index = entries.index(target - 1) + 1 if target else 0
+        entries.insert(new_index, target)
+        moves.append((positions[target], new_index))
+
+    return removed, [new_ids[index] for index in added], moves
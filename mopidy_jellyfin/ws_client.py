@@ -9,7 +9,7 @@ import time
 import requests
 import threading
 import mopidy_jellyfin
-from .http import JellyfinHttpClient
+from .http import get_client
 
 import websocket
 
@@ -36,17 +36,13 @@ class WSClient(threading.Thread):
         self.client = client
         self.device_id = mopidy_jellyfin.Extension.device_id
         # Load things from config file
-        cert = None
-        client_cert = self.client.config['jellyfin'].get('client_cert', None)
-        client_key = self.client.config['jellyfin'].get('client_key', None)
-        if client_cert is not None and client_key is not None:
-            cert = (client_cert, client_key)
         self.hostname = self.client.config['jellyfin'].get('hostname')
-        proxy = self.client.config.get('proxy', None)
 
         self.token = self.client.token
-        headers = {'x-mediabrowser-token': self.token}
-        self.http = JellyfinHttpClient(headers, cert, proxy)
+        # Shared with the backend, which may already have set the token
+        self.http = get_client(self.client.config)
+        if self.token:
+            self.http.headers['x-mediabrowser-token'] = self.token
         threading.Thread.__init__(self)
 
     def send(self, message, data=""):
@@ -139,3 +135,7 @@ class WSClient(threading.Thread):
             self.client.playstate(data)
         elif message == 'GeneralCommand':
             self.client.general_command(data)
+        elif message == 'LibraryChanged':
+            self.client.library_changed(data)
+        elif message == 'UserDataChanged':
+            self.client.user_data_changed(data)
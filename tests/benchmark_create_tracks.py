@@ -0,0 +1,72 @@
+'''
+Measures how many Jellyfin items per second are turned into Mopidy
+tracks, one at a time and in batches.  Run it with
+
+    python -m tests.benchmark_create_tracks [number of tracks]
+
+and compare the numbers between releases on the same machine.
+'''
+from __future__ import unicode_literals
+
+import sys
+import time
+
+from mopidy_jellyfin.records import flyweights
+from mopidy_jellyfin.remote import JellyfinHandler
+
+
+def make_items(count, per_album=12, albums_per_artist=4):
+    items = []
+    for i in range(count):
+        album = i // per_album
+        artist = album // albums_per_artist
+        artists = [{'Id': f'artist{artist}', 'Name': f'Artist {artist}'}]
+        items.append({
+            'Id': f'track{i}',
+            'Name': f'Track {i}',
+            'Type': 'Audio',
+            'IndexNumber': i % per_album + 1,
+            'ParentIndexNumber': 1,
+            'RunTimeTicks': 2400000000,
+            'PremiereDate': '2019-12-13T00:00:00.0000000Z',
+            'Genres': ['Rock', 'Indie'],
+            'Album': f'Album {album}',
+            'AlbumId': f'album{album}',
+            'AlbumArtists': artists,
+            'ArtistItems': artists,
+            'Artists': [artists[0]['Name']],
+            'MediaSources': [{'MediaStreams': [
+                {'Type': 'Video'}, {'Type': 'Audio', 'BitRate': 320000}]}],
+        })
+    return items
+
+
+def measure(func, items, rounds=3):
+    # Best of a few rounds, each starting without shared models
+    best = None
+    for _ in range(rounds):
+        flyweights.clear()
+        start = time.perf_counter()
+        func(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(items) / best
+
+
+def main(count=20000):
+    handler = JellyfinHandler.__new__(JellyfinHandler)
+    handler.watched_status = False
+    items = make_items(count)
+
+    results = [
+        ('create_track', measure(
+            lambda items: [handler.create_track(i) for i in items], items)),
+        ('create_tracks', measure(handler.create_tracks, items)),
+        ('create_records', measure(handler.create_records, items)),
+    ]
+    for name, rate in results:
+        print(f'{name:>16}: {rate:10.0f} items/s')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
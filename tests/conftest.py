@@ -34,6 +34,32 @@ def jellyfin_client(config, mocker):
     return mopidy_jellyfin.remote.JellyfinHandler(config)
 
 
+@pytest.fixture
+def bare_client():
+    """A handler that skips __init__, so nothing talks to a server."""
+    handler = mopidy_jellyfin.remote.JellyfinHandler
+    client = handler.__new__(handler)
+    client.hostname = 'https://foo.bar'
+    client.user_id = 'user'
+    client.watched_status = False
+    client.albumartistsort = True
+    client.library_sync = None
+    client.image_params = {}
+    client.image_proxy = False
+    client.page_size = 500
+    client.read_ahead = 0
+    client._pager = None
+    client.http = mock.Mock()
+    client.http.gather.side_effect = lambda calls: [call() for call in calls]
+    handler.get_item.cache.clear()
+    handler.get_image_tag.cache.clear()
+
+    yield client
+
+    handler.get_item.cache.clear()
+    handler.get_image_tag.cache.clear()
+
+
 @pytest.fixture
 def backend_mock():
     backend_mock = mock.Mock(autospec=mopidy_jellyfin.backend.JellyfinBackend)
@@ -0,0 +1,249 @@
+from __future__ import unicode_literals
+
+import functools
+import threading
+import time
+
+import mock
+
+import pytest
+
+import requests
+
+from mopidy_jellyfin.http import (
+    AsyncTransport, CircuitBreaker, JellyfinHttpClient, RetryPolicy,
+    get_client
+)
+
+
+def response(status, headers=None, data=None):
+    r = mock.Mock(status_code=status, headers=headers or {})
+    r.json.return_value = data or {}
+    r.text = 'text'
+    return r
+
+
+@pytest.fixture
+def client():
+    client = JellyfinHttpClient({}, proxy={})
+    client.session = mock.Mock(headers={})
+    return client
+
+
+@pytest.fixture
+def sleep(mocker):
+    return mocker.patch('mopidy_jellyfin.http.time.sleep')
+
+
+@pytest.mark.parametrize('method,status,expected', [
+    ('GET', None, True),
+    ('GET', 503, True),
+    ('GET', 404, False),
+    ('POST', None, False),
+    ('POST', 500, False),
+    ('POST', 429, True),
+])
+def test_should_retry(method, status, expected):
+    policy = RetryPolicy()
+    r = response(status) if status else None
+
+    assert policy.should_retry(method, 0, r) is expected
+    assert policy.should_retry(method, policy.retries, r) is False
+
+
+def test_delay_honors_retry_after():
+    policy = RetryPolicy(max_backoff=30)
+
+    assert policy.delay(0, response(503, {'Retry-After': '7'})) == 7
+    assert policy.delay(0, response(503, {'Retry-After': '600'})) == 30
+    assert 0 <= policy.delay(3, response(503)) <= 4
+
+
+def test_get_retries_server_errors(client, sleep):
+    client.session.request.side_effect = [
+        requests.ConnectionError('refused'),
+        response(503),
+        response(200, data={'Id': 'abc'}),
+    ]
+
+    assert client.get('http://foo.bar/Items') == {'Id': 'abc'}
+    assert client.session.request.call_count == 3
+    assert sleep.call_count == 2
+
+
+def test_post_is_not_repeated_after_connection_error(client, sleep):
+    client.session.request.side_effect = requests.ConnectionError('reset')
+
+    with pytest.raises(Exception):
+        client.post('http://foo.bar/Sessions/Playing')
+
+    assert client.session.request.call_count == 1
+
+
+def test_circuit_breaker_fails_fast(client, sleep):
+    client.session.request.side_effect = requests.ConnectionError('down')
+
+    with pytest.raises(Exception):
+        client.get('http://foo.bar/Items')
+    assert client.breaker.is_open
+
+    calls = client.session.request.call_count
+    with pytest.raises(Exception) as execinfo:
+        client.get('http://foo.bar/Items')
+
+    assert 'unavailable' in str(execinfo.value)
+    assert client.session.request.call_count == calls
+
+
+def test_circuit_breaker_probes_for_recovery(mocker):
+    monotonic = mocker.patch(
+        'mopidy_jellyfin.http.time.monotonic', return_value=100)
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+
+    assert not breaker.allow()
+
+    monotonic.return_value = 131
+    assert breaker.allow()
+    # Only a single probe at a time
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.allow()
+    assert not breaker.is_open
+
+
+def test_probe_is_released_without_an_outcome(client, mocker):
+    monotonic = mocker.patch(
+        'mopidy_jellyfin.http.time.monotonic', return_value=100)
+    client.breaker = CircuitBreaker(threshold=1, reset_timeout=30)
+    client.breaker.record_failure()
+    monotonic.return_value = 131
+
+    # Out of time before the probe is sent
+    with client.deadline(1):
+        monotonic.return_value = 132
+        with pytest.raises(Exception) as execinfo:
+            client.get('http://foo.bar/Items')
+    assert 'deadline' in str(execinfo.value)
+
+    client.session.request.side_effect = ValueError('bad url')
+    with pytest.raises(ValueError):
+        client.get('http://foo.bar/Items')
+
+    client.session.request.side_effect = None
+    client.session.request.return_value = response(200, data={'Id': 'abc'})
+    assert client.get('http://foo.bar/Items') == {'Id': 'abc'}
+    assert not client.breaker.is_open
+
+
+def test_deadline_limits_retries(client, sleep, mocker):
+    monotonic = mocker.patch(
+        'mopidy_jellyfin.http.time.monotonic', return_value=100)
+    client.retry = RetryPolicy(backoff=10, max_backoff=10)
+    mocker.patch('mopidy_jellyfin.http.random.uniform', return_value=10)
+    client.session.request.return_value = response(503)
+
+    with client.deadline(5):
+        with pytest.raises(Exception) as execinfo:
+            client.get('http://foo.bar/Items')
+        monotonic.return_value = 103
+        assert client._timeout() == (2, 2)
+
+    assert 'deadline' in str(execinfo.value)
+    assert client.session.request.call_count == 1
+    assert not sleep.called
+    assert client._timeout() == (5, 30)
+
+
+def test_get_client_is_shared(config, mocker):
+    mocker.patch.dict('mopidy_jellyfin.http._clients', clear=True)
+    config['proxy'] = {}
+    config['jellyfin']['pool_size'] = 4
+
+    client = get_client(config)
+
+    assert get_client(config) is client
+    assert client.session.get_adapter('https://foo.bar')._pool_maxsize == 4
+
+    config['jellyfin']['hostname'] = 'https://other.bar'
+    assert get_client(config) is not client
+
+
+def test_check_redirect_is_resolved_once(client):
+    client.session.request.return_value = response(200)
+    client.session.request.return_value.url = (
+        'https://jellyfin.foo.bar/system/info/public')
+
+    assert client.check_redirect('foo.bar') == 'https://jellyfin.foo.bar'
+    assert client.check_redirect('foo.bar') == 'https://jellyfin.foo.bar'
+    assert client.session.request.call_count == 1
+
+
+def test_gather_runs_calls_concurrently():
+    transport = AsyncTransport(concurrency=2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def call(value):
+        with lock:
+            running.append(value)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(value)
+        return value * 2
+
+    results = transport.gather(functools.partial(call, i) for i in range(6))
+
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert max(peak) == 2
+
+
+def test_gather_errors():
+    transport = AsyncTransport()
+
+    def fail():
+        raise Exception('down')
+
+    calls = [lambda: 1, fail]
+    with pytest.raises(Exception):
+        transport.gather(calls)
+
+    results = transport.gather(calls, return_exceptions=True)
+    assert results[0] == 1
+    assert isinstance(results[1], Exception)
+
+
+def test_nested_gather_does_not_deadlock():
+    transport = AsyncTransport(concurrency=2)
+
+    def outer(value):
+        return sum(transport.gather([lambda: value, lambda: value]))
+
+    results = transport.gather(
+        functools.partial(outer, i) for i in range(4))
+
+    assert results == [0, 2, 4, 6]
+
+
+def test_requests_wait_for_connection(client, mocker):
+    monotonic = mocker.patch(
+        'mopidy_jellyfin.http.time.monotonic', return_value=100)
+    client.session.request.return_value = response(200, data={'Id': 'abc'})
+    client.expect_connection(10)
+
+    with client.connecting():
+        assert client.get('http://foo.bar/system/info/public')
+
+    # Past the grace period requests fail right away
+    monotonic.return_value = 111
+    with pytest.raises(Exception) as execinfo:
+        client.get('http://foo.bar/Items')
+    assert 'not connected' in str(execinfo.value)
+    assert client.session.request.call_count == 1
+
+    client.connected.set()
+    assert client.get('http://foo.bar/Items') == {'Id': 'abc'}
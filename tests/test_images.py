@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+
+import mock
+
+import pytest
+
+from mopidy_jellyfin.images import (
+    ImageCache, content_type, factory, image_params
+)
+
+
+def test_image_cache_evicts_least_recently_used(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    assert cache.get('a') == b'1234'
+
+    cache.set('c', b'1234')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == cache.get('c') == b'1234'
+    assert cache.size == 8
+    assert sorted(os.listdir(str(tmp_path))) == ['a', 'c']
+
+
+def test_image_cache_survives_restarts(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    os.utime(str(tmp_path / 'a'), (1, 1))
+
+    cache = ImageCache(str(tmp_path), max_bytes=5)
+
+    assert len(cache) == 1
+    assert cache.get('b') == b'1234'
+
+
+def test_concurrent_misses_share_a_fetch(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=10)
+
+    def fetch():
+        time.sleep(0.05)
+        return b'1234'
+
+    fetch_mock = mock.Mock(side_effect=fetch)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get_or_fetch('a', fetch_mock)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [b'1234'] * 4
+    assert fetch_mock.call_count == 1
+    assert os.listdir(str(tmp_path)) == ['a']
+
+
+def test_unfinished_writes_are_removed(tmp_path):
+    (tmp_path / 'a.1234.tmp').write_bytes(b'12')
+
+    cache = ImageCache(str(tmp_path), max_bytes=10)
+
+    assert len(cache) == 0
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_factory_needs_the_proxy(config, tmp_path):
+    config['core'] = {'cache_dir': str(tmp_path)}
+
+    assert factory(config, None) == []
+
+    config['jellyfin']['image_proxy'] = True
+    assert len(factory(config, None)) == 1
+
+
+@pytest.mark.parametrize('data,expected', [
+    (b'\x89PNG\r\n', 'image/png'),
+    (b'GIF89a', 'image/gif'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+])
+def test_content_type(data, expected):
+    assert content_type(data) == expected
+
+
+def test_image_params(config):
+    assert image_params(config) == {}
+
+    config['jellyfin']['image_max_width'] = 300
+    assert image_params(config) == {'maxWidth': 300}
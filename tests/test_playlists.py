@@ -0,0 +1,137 @@
+from __future__ import unicode_literals
+
+import mock
+
+from mopidy.models import Track
+
+import pytest
+
+from mopidy_jellyfin.playlists import JellyfinPlaylistsProvider
+from mopidy_jellyfin.records import TrackRecord
+
+
+@pytest.fixture
+def remote():
+    remote = mock.Mock()
+    remote.store = None
+    remote.http.deadline.return_value = mock.MagicMock()
+    remote.get_favorite_items.return_value = {
+        'Tracks': [{'Id': 'f1'}], 'Albums': [], 'Artists': []}
+    remote.get_favorite_tracks.side_effect = lambda kind, items: [
+        TrackRecord(item['Id'], item['Id']) for item in items]
+    remote.get_playlists.return_value = [
+        {'Id': 'p1', 'Name': 'One', 'DateLastSaved': 'a', 'ChildCount': 1},
+        {'Id': 'p2', 'Name': 'Two', 'DateLastSaved': 'a', 'ChildCount': 1},
+    ]
+    remote.get_playlist_contents.side_effect = lambda playlist_id: [
+        {'Id': f'{playlist_id}-t1', 'Type': 'Audio'}]
+    remote.create_records.side_effect = lambda items: [
+        TrackRecord(item['Id'], item['Id']) for item in items]
+    return remote
+
+
+def make_backend(remote):
+    return mock.Mock(remote=remote, config={'jellyfin': {}})
+
+
+@pytest.fixture
+def provider(remote):
+    with mock.patch('mopidy_jellyfin.playlists.backend.BackendListener'):
+        provider = JellyfinPlaylistsProvider(backend=make_backend(remote))
+        provider.load()
+        yield provider
+
+
+def test_refresh_does_not_fetch_contents(provider, remote):
+    assert [ref.name for ref in provider.as_list()] == [
+        'Favorites - All', 'Favorites - Tracks', 'One', 'Two']
+    assert not remote.get_playlist_contents.called
+    assert not remote.get_favorite_tracks.called
+
+
+def test_contents_are_fetched_once(provider, remote):
+    playlist = provider.lookup('jellyfin:playlist:p1')
+    provider.get_items('jellyfin:playlist:p1')
+
+    assert playlist.tracks[0].uri == 'jellyfin:track:p1-t1'
+    remote.get_playlist_contents.assert_called_once_with('p1')
+    assert provider.lookup('jellyfin:playlist:foo') is None
+
+
+def test_refresh_drops_changed_contents(provider, remote):
+    provider.lookup('jellyfin:playlist:p1')
+    provider.lookup('jellyfin:playlist:p2')
+
+    remote.get_playlists.return_value[1]['DateLastSaved'] = 'b'
+    provider.refresh()
+    provider.lookup('jellyfin:playlist:p1')
+    provider.lookup('jellyfin:playlist:p2')
+
+    assert remote.get_playlist_contents.call_count == 3
+    remote.get_playlist_contents.assert_called_with('p2')
+
+
+def test_save_drops_saved_contents(provider, remote):
+    provider.lookup('jellyfin:playlist:p1')
+    provider.lookup('jellyfin:playlist:p2')
+    provider.save(mock.Mock(uri='jellyfin:playlist:p1', tracks=[]))
+    provider.lookup('jellyfin:playlist:p1')
+    provider.lookup('jellyfin:playlist:p2')
+
+    remote.update_playlist.assert_called_with('p1', [])
+    assert remote.get_playlist_contents.call_count == 3
+    remote.get_playlist_contents.assert_called_with('p1')
+    assert remote.get_favorite_items.call_count == 1
+
+
+def test_favorites_all_combines_kinds(provider, remote):
+    playlist = provider.lookup('jellyfin:playlist:favorite-All')
+
+    assert [track.uri for track in playlist.tracks] == ['jellyfin:track:f1']
+    remote.get_favorite_tracks.assert_called_once_with(
+        'Tracks', [{'Id': 'f1'}])
+
+
+def test_refresh_waits_for_connection(remote):
+    remote.ready.is_set.return_value = False
+    with mock.patch('mopidy_jellyfin.playlists.backend.BackendListener'):
+        provider = JellyfinPlaylistsProvider(backend=make_backend(remote))
+        provider.refresh()
+
+    assert not remote.get_playlists.called
+    assert provider.as_list() == []
+
+
+def test_playlists_share_track_records(provider, remote):
+    remote.get_playlist_contents.side_effect = lambda playlist_id: [
+        {'Id': 'same', 'Type': 'Audio'}]
+
+    one = provider._tracks('jellyfin:playlist:p1')
+    two = provider._tracks('jellyfin:playlist:p2')
+
+    assert one[0] is two[0]
+    assert isinstance(provider.lookup('jellyfin:playlist:p1').tracks[0], Track)
+
+
+def test_invalidate_drops_playlists_holding_changed_tracks(provider, remote):
+    provider.lookup('jellyfin:playlist:p1')
+    provider.lookup('jellyfin:playlist:p2')
+    provider.lookup('jellyfin:playlist:favorite-Tracks')
+
+    provider.invalidate(updated=['p2-t1'], removed=['f1'])
+    provider.lookup('jellyfin:playlist:p1')
+    provider.lookup('jellyfin:playlist:p2')
+    provider.lookup('jellyfin:playlist:favorite-Tracks')
+
+    assert remote.get_playlist_contents.call_count == 3
+    remote.get_playlist_contents.assert_called_with('p2')
+    assert remote.get_favorite_tracks.call_count == 2
+
+
+def test_lookups_have_a_deadline(provider, remote):
+    remote.request_deadline = 30
+    provider.lookup('jellyfin:playlist:p1')
+    provider.get_items('jellyfin:playlist:p2')
+
+    remote.http.deadline.assert_called_with(30)
+    assert remote.http.deadline.return_value.__enter__.call_count >= 2
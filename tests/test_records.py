@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+
+import gc
+
+from mopidy.models import Album, Artist, Track
+
+from mopidy_jellyfin.records import (
+    ModelCache, TrackRecord, TrackStore, as_model, flyweights
+)
+
+
+def record(**kwargs):
+    artist = flyweights.artist('r1', 'Foo')
+    values = dict(
+        name='Baz', bitrate=320, track_no=1, disc_no=1, genre='Rock',
+        length=1000, date='2019-01-01', artists=[artist],
+        album=flyweights.album('a1', 'Bar', [artist], '2019-01-01'))
+    values.update(kwargs)
+    return TrackRecord('t1', **values)
+
+
+def test_track():
+    artists = [Artist(name='Foo', uri='jellyfin:artist:r1')]
+
+    assert record().track() == Track(
+        uri='jellyfin:track:t1', name='Baz', bitrate=320, track_no=1,
+        disc_no=1, genre='Rock', length=1000, date='2019-01-01',
+        artists=artists,
+        album=Album(
+            name='Bar', artists=artists, uri='jellyfin:album:a1',
+            date='2019-01-01')
+    )
+    assert record(album=None).track().album is None
+
+
+def test_models_are_shared():
+    one = record()
+    two = record(genre=''.join(['Ro', 'ck']))
+
+    assert one.album is two.album
+    assert one.artists[0] is two.artists[0]
+    assert one.genre is two.genre
+    assert one == two
+
+
+def test_changed_models_are_not_shared():
+    cache = ModelCache()
+    artist = cache.artist('r1', 'Foo')
+
+    assert cache.artist('r1', 'Foo') is artist
+    assert cache.artist('r1', 'New').name == 'New'
+    assert cache.album('a1', 'Bar', [artist], None) is cache.album(
+        'a1', 'Bar', [artist], None)
+    assert cache.album('a1', 'Bar', [artist], '2019-01-01').date == (
+        '2019-01-01')
+
+
+def test_as_model():
+    track = Track(uri='jellyfin:track:t1')
+
+    assert as_model(track) is track
+    assert as_model(record()).uri == 'jellyfin:track:t1'
+
+
+def test_track_store():
+    store = TrackStore()
+    first = store.add(record())
+
+    assert store.add(record()) is first
+    updated = store.add(record(name='New'))
+    assert updated is not first
+    assert store.add(record(name='New')) is updated
+
+    del first, updated
+    gc.collect()
+    assert len(store) == 0
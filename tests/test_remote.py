@@ -1,16 +1,19 @@
 from __future__ import unicode_literals
 
 import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
 
 import mock
 
-from mopidy.models import Album, Artist, Ref, SearchResult, Track
+from mopidy.models import Album, Artist, Image, Ref, SearchResult, Track
 
 import pytest
 
 import requests
 
-from mopidy_jellyfin import backend
+from mopidy_jellyfin import backend, remote
+from mopidy_jellyfin.http import JellyfinHttpClient
 
 
 @pytest.mark.parametrize('hostname,url,expected', [
@@ -556,3 +559,210 @@ def test_lookup_artist(r_get_mock, jellyfin_client):
             uri='jellyfin:track:057801bc10cf08ce96e1e19bf98c407f'
         )
      ]
+
+
+@pytest.fixture
+def paged_client(bare_client):
+    client = bare_client
+    client.page_size = 2
+    client._pager = ThreadPoolExecutor(max_workers=3)
+    client.http = JellyfinHttpClient({}, proxy={})
+    client.http.get = mock.Mock()
+    client.deadlines = []
+    items = [{'Id': str(i)} for i in range(5)]
+
+    def get(url):
+        client.deadlines.append(client.http._remaining())
+        start = int(parse_qs(urlsplit(url).query)['StartIndex'][0])
+        return {'Items': items[start:start + 2], 'TotalRecordCount': 5}
+
+    client.http.get.side_effect = get
+    return client
+
+
+@pytest.mark.parametrize('read_ahead', [0, 1, 3])
+def test_get_paged(paged_client, read_ahead):
+    paged_client.read_ahead = read_ahead
+
+    items = list(paged_client.get_paged('/Items', {'Recursive': 'true'}))
+
+    assert [item['Id'] for item in items] == ['0', '1', '2', '3', '4']
+    assert paged_client.http.get.call_count == 3
+
+
+def test_get_paged_read_ahead_keeps_the_deadline(paged_client):
+    paged_client.read_ahead = 2
+
+    with paged_client.http.deadline(30):
+        items = list(paged_client.get_paged('/Items', {}))
+
+    assert len(items) == 5
+    assert all(0 < remaining <= 30 for remaining in paged_client.deadlines)
+
+
+@pytest.mark.parametrize('profile,watched_status,fields,user_data', [
+    ('browse', False, '', 'false'),
+    ('browse', True, '', 'false'),
+    ('track', False, 'MediaSources,Genres', 'false'),
+    ('track', True, 'MediaSources,Genres', 'true'),
+])
+def test_fields(bare_client, profile, watched_status, fields, user_data):
+    client = bare_client
+    client.watched_status = watched_status
+
+    params = client._fields(profile)
+
+    assert params['Fields'] == fields
+    assert params['EnableUserData'] == user_data
+    assert params['EnableImages'] == 'false'
+    assert remote.FIELD_PROFILES[profile]['EnableUserData'] == 'false'
+
+
+def test_update_playlist_batches_edits(bare_client):
+    client = bare_client
+    before = [
+        {'Id': item_id, 'PlaylistItemId': f'e{item_id}'}
+        for item_id in 'abcd']
+    after = before[:1] + before[2:] + [{'Id': 'x', 'PlaylistItemId': 'ex'}]
+    client.get_playlist_contents = mock.Mock(side_effect=[before, after])
+
+    client.update_playlist('p1', ['x', 'd', 'a', 'c'])
+
+    assert client.http.delete.call_count == 1
+    assert 'EntryIds=eb' in client.http.delete.call_args[0][0]
+    urls = [c[0][0] for c in client.http.post.call_args_list]
+    assert 'Ids=x' in urls[0]
+    assert urls[1:] == [
+        'https://foo.bar/Playlists/p1/Items/ex/Move/0?format=json',
+        'https://foo.bar/Playlists/p1/Items/ed/Move/1?format=json',
+    ]
+
+
+@pytest.mark.parametrize('albumartistsort', [True, False])
+def test_favorite_tracks_use_bulk_queries(bare_client, albumartistsort):
+    client = bare_client
+    client.albumartistsort = albumartistsort
+    client.create_records = mock.Mock(
+        side_effect=lambda items: [item['Id'] for item in items])
+    tracks = [
+        {'Id': 't1', 'AlbumId': 'a1', 'Album': 'B',
+         'AlbumArtists': [{'Id': 'r1'}], 'ArtistItems': [{'Id': 'r2'}]},
+        {'Id': 't2', 'AlbumId': 'a2', 'Album': 'A',
+         'AlbumArtists': [{'Id': 'r1'}], 'ArtistItems': []},
+    ]
+    client.get_paged = mock.Mock(return_value=tracks)
+
+    albums = client.get_favorite_tracks('Albums', [{'Id': 'a2'}, {'Id': 'a1'}])
+    artists = client.get_favorite_tracks(
+        'Artists', [{'Id': 'r1'}, {'Id': 'r2'}])
+
+    assert albums == ['t2', 't1']
+    if albumartistsort:
+        assert artists == ['t2', 't1']
+    else:
+        assert artists == ['t2', 't1', 't1']
+    assert client.get_paged.call_count == 2
+    assert client.get_paged.call_args_list[0][0][1]['AlbumIds'] == 'a2,a1'
+
+
+def test_get_items_in_bulk(bare_client, mocker):
+    mocker.patch.object(remote, 'IDS_PER_QUERY', 2)
+    client = bare_client
+
+    def get(url):
+        ids = parse_qs(urlsplit(url).query)['Ids'][0].split(',')
+        return {'Items': [{'Id': i} for i in ids if i != 'gone']}
+
+    client.http.get.side_effect = get
+    client.get_item.prime({'Id': 'a', 'Name': 'cached'}, client, 'a')
+
+    items = client.get_items(['a', 'b', 'c', 'gone', 'b'])
+
+    assert items == {
+        'a': {'Id': 'a', 'Name': 'cached'}, 'b': {'Id': 'b'}, 'c': {'Id': 'c'}}
+    assert client.http.get.call_count == 2
+    assert client.get_item('c') == {'Id': 'c'}
+    assert client.http.get.call_count == 2
+
+
+def test_get_images_from_tags(bare_client):
+    client = bare_client
+    client.image_params = {'maxWidth': 300}
+    client.http.get.return_value = {'Items': [
+        {'Id': 'album', 'ImageTags': {'Primary': 'tag1'}},
+        {'Id': 'track', 'ImageTags': {},
+         'AlbumId': 'album', 'AlbumPrimaryImageTag': 'tag1'},
+        {'Id': 'bare', 'ImageTags': {}},
+    ]}
+
+    images = client.get_images(['album', 'track', 'bare', 'gone'])
+
+    url = 'https://foo.bar/Items/album/Images/Primary?maxWidth=300&tag=tag1'
+    assert images['album'] == [Image(uri=url)]
+    assert images['track'] == [Image(uri=url)]
+    assert images['bare'] == images['gone'] == []
+    assert client.http.get.call_count == 1
+
+    # Known tags aren't requested again
+    assert client.get_images(['track', 'gone'])['track'] == [Image(uri=url)]
+    assert client.http.get.call_count == 1
+
+    client.image_proxy = True
+    assert client.get_images(['track'])['track'] == [
+        Image(uri='/jellyfin/image/album/tag1')]
+
+
+def test_tracks_share_album_and_artists(bare_client):
+    client = bare_client
+    artists = [{'Id': 'r1', 'Name': 'Foo'}]
+    tracks = [
+        client.create_track({
+            'Id': track_id, 'Name': track_id, 'Type': 'Audio',
+            'AlbumId': 'a1', 'Album': 'Bar', 'ProductionYear': 2019,
+            'ArtistItems': artists, 'AlbumArtists': artists})
+        for track_id in ('t1', 't2')
+    ]
+
+    assert tracks[0].album is tracks[1].album
+    assert tracks[0].album == Album(
+        name='Bar', uri='jellyfin:album:a1', date='2019',
+        artists=[Artist(name='Foo', uri='jellyfin:artist:r1')])
+    assert list(tracks[0].artists)[0] is list(tracks[1].artists)[0]
+
+
+def test_create_tracks_matches_create_track(bare_client):
+    client = bare_client
+    artists = [{'Id': 'r1', 'Name': 'Foo'}]
+    items = [
+        {'Id': track_id, 'Name': track_id, 'Type': 'Audio',
+         'AlbumId': 'a1', 'Album': 'Bar', 'PremiereDate': '2019-12-13',
+         'IndexNumber': number, 'RunTimeTicks': 1000000,
+         'ArtistItems': artists, 'AlbumArtists': artists,
+         'MediaSources': [{'MediaStreams': [
+             {'Type': 'Audio', 'BitRate': 320000}]}]}
+        for number, track_id in enumerate(('t1', 't2', 't3'), 1)
+    ] + [{'Id': 'b1', 'Name': 'Book', 'Type': 'Book', 'Album': 'Bar'}]
+
+    tracks = client.create_tracks(items)
+
+    assert tracks == [client.create_track(item) for item in items]
+    assert tracks[0].bitrate == 320
+    assert tracks[2].track_no == 3
+    assert tracks[0].album is tracks[2].album
+
+
+def test_create_tracks_keeps_albums_apart(bare_client):
+    client = bare_client
+    items = [
+        {'Id': 't1', 'Name': 'One', 'Type': 'Audio', 'Album': 'One',
+         'ArtistItems': [{'Id': 'r1', 'Name': 'Foo'}]},
+        {'Id': 't2', 'Name': 'Two', 'Type': 'Audio', 'Album': 'Two',
+         'ArtistItems': [{'Id': 'r2', 'Name': 'Bar'}]},
+    ]
+
+    tracks = client.create_tracks(items)
+
+    assert [track.album.name for track in tracks] == ['One', 'Two']
+    assert tracks[1] == client.create_track(items[1])
+    assert tracks[1].album.artists == frozenset(
+        [Artist(name='Bar', uri='jellyfin:artist:r2')])
@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+from mopidy.models import Album, Artist, Track
+
+import pytest
+
+from mopidy_jellyfin.search import SearchIndex, tokenize
+
+
+ITEMS = [
+    ({'Id': 'a1', 'Type': 'MusicArtist', 'Name': 'Björk'},
+     Artist(name='Björk', uri='jellyfin:artist:a1')),
+    ({'Id': 'b1', 'Type': 'MusicAlbum', 'Name': 'Homogenic',
+      'Artists': ['Björk'], 'AlbumArtist': 'Björk'},
+     Album(name='Homogenic', uri='jellyfin:album:b1')),
+    ({'Id': 't1', 'Type': 'Audio', 'Name': 'Hunter', 'Album': 'Homogenic',
+      'Artists': ['Björk'], 'AlbumArtist': 'Björk', 'Genres': ['Electronic']},
+     Track(name='Hunter', uri='jellyfin:track:t1')),
+    ({'Id': 't2', 'Type': 'Audio', 'Name': 'Joga', 'Album': 'Homogenic',
+      'Artists': ['Björk'], 'AlbumArtist': 'Björk', 'Genres': ['Electronic']},
+     Track(name='Joga', uri='jellyfin:track:t2')),
+]
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    for item, model in ITEMS:
+        index.add(item, model)
+    return index
+
+
+def test_tokenize():
+    assert tokenize('Björk - Jóga (Live)') == ['bjork', 'joga', 'live']
+
+
+@pytest.mark.parametrize('query,tracks,albums,artists', [
+    ({'any': ['bjork']}, ['t1', 't2'], ['b1'], ['a1']),
+    ({'any': ['BJÖ hun']}, ['t1'], [], []),
+    ({'track_name': ['homo']}, [], [], []),
+    ({'album': ['homo']}, ['t1', 't2'], ['b1'], []),
+    ({'artist': ['bjork'], 'track_name': ['jo']}, ['t2'], [], []),
+    ({'genre': ['electro']}, ['t1', 't2'], [], []),
+])
+def test_search(index, query, tracks, albums, artists):
+    result = index.search(query)
+
+    assert [i.uri.split(':')[-1] for i in result.tracks] == tracks
+    assert [i.uri.split(':')[-1] for i in result.albums] == albums
+    assert [i.uri.split(':')[-1] for i in result.artists] == artists
+
+
+def test_remove(index):
+    index.remove('t1')
+
+    assert index.search({'any': ['hunter']}).tracks == ()
+    assert len(index) == 3
+
+
+@pytest.mark.parametrize('query,expected', [
+    ({'any': ['bjork'], 'genre': ['electro']}, True),
+    ({'artist': ['bjork'], 'composer': ['bjork']}, False),
+])
+def test_supports(index, query, expected):
+    assert index.supports(query) is expected
@@ -0,0 +1,98 @@
+from __future__ import unicode_literals
+
+import sqlite3
+
+from mock import patch
+
+from mopidy.models import Album, Artist, Track
+
+from mopidy_jellyfin.store import MetadataStore
+
+
+def test_set_get(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    store.set('get_item', ['abc'], {'Id': 'abc', 'Name': 'Moth'})
+
+    assert store.get('get_item', ['abc']) == {'Id': 'abc', 'Name': 'Moth'}
+    assert store.get('get_item', ['def']) is None
+
+
+def test_models_roundtrip(tmp_path):
+    track = Track(
+        uri='jellyfin:track:abc',
+        name='Ottawa to Osaka',
+        artists=[Artist(name='Chairlift')],
+        album=Album(name='Moth', artists=[Artist(name='Chairlift')])
+    )
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    store.set('get_track', ['abc'], track)
+
+    assert store.get('get_track', ['abc']) == track
+
+
+def test_expired_entries(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'), ttl=60)
+    with patch('mopidy_jellyfin.store.time.time', return_value=1000):
+        store.set('get_item', ['abc'], {'Id': 'abc'})
+    with patch('mopidy_jellyfin.store.time.time', return_value=1100):
+        assert store.get('get_item', ['abc']) is None
+
+
+def test_survives_reopen(tmp_path):
+    path = str(tmp_path / 'metadata.db')
+    store = MetadataStore(path)
+    store.set('get_item', ['abc'], {'Id': 'abc'})
+    store.close()
+
+    assert MetadataStore(path).get('get_item', ['abc']) == {'Id': 'abc'}
+
+
+def test_schema_change_resets(tmp_path):
+    path = str(tmp_path / 'metadata.db')
+    store = MetadataStore(path)
+    store.set('get_item', ['abc'], {'Id': 'abc'})
+    store.close()
+
+    with patch.object(
+            MetadataStore, 'SCHEMA_VERSION', MetadataStore.SCHEMA_VERSION + 1):
+        assert MetadataStore(path).get('get_item', ['abc']) is None
+
+
+def test_corrupt_database_recovers(tmp_path):
+    path = tmp_path / 'metadata.db'
+    path.write_bytes(b'this is not a database' * 100)
+
+    store = MetadataStore(str(path))
+    store.set('get_item', ['abc'], {'Id': 'abc'})
+
+    assert store.get('get_item', ['abc']) == {'Id': 'abc'}
+    conn = sqlite3.connect(str(path))
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == (
+        MetadataStore.SCHEMA_VERSION)
+
+
+def test_delete_referencing(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    store.set('get_item', ['abc'], {'Id': 'abc'})
+    store.set('get_item', ['def'], {'Id': 'def'})
+    store.set('get_items', [{'ParentId': 'ghi'}], ['abc'])
+    store.set('get_other', ['abc'], {'Id': 'abc'})
+
+    store.delete_referencing(['get_item', 'get_items'], ['abc', 'ghi'])
+
+    assert store.get('get_item', ['abc']) is None
+    assert store.get('get_items', [{'ParentId': 'ghi'}]) is None
+    assert store.get('get_item', ['def']) == {'Id': 'def'}
+    assert store.get('get_other', ['abc']) == {'Id': 'abc'}
+
+    store.delete('get_item')
+    store.delete_referencing(['get_item'], ['def'])
+    assert store.get('get_item', ['def']) is None
+
+
+def test_bulk_operations(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    store.set_many('library', {'abc': {'Id': 'abc'}, 'def': {'Id': 'def'}})
+    store.delete_many('library', ['abc'])
+
+    assert store.get_all('library') == {'def': {'Id': 'def'}}
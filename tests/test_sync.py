@@ -0,0 +1,116 @@
+from __future__ import unicode_literals
+
+import threading
+
+import mock
+
+import pytest
+
+from mopidy_jellyfin.store import MetadataStore
+from mopidy_jellyfin.sync import LibrarySync, compact_item
+
+
+ARTIST = {'Id': 'a1', 'Type': 'MusicArtist', 'Name': 'Chairlift'}
+ALBUM = {
+    'Id': 'b1', 'Type': 'MusicAlbum', 'Name': 'Moth', 'SortName': 'moth',
+    'AlbumArtists': [{'Id': 'a1', 'Name': 'Chairlift'}]
+}
+TRACKS = [
+    {'Id': 't%d' % i, 'Type': 'Audio', 'Name': 'Track %d' % i,
+     'SortName': 'track %d' % i, 'AlbumId': 'b1',
+     'AlbumArtists': [{'Id': 'a1', 'Name': 'Chairlift'}]}
+    for i in range(3)
+]
+
+
+@pytest.fixture
+def remote():
+    remote = mock.Mock()
+    remote.get_library_ids.return_value = ['lib']
+    remote.get_library_items.return_value = [ALBUM] + TRACKS
+    remote.fetch_library_artists.return_value = [ARTIST]
+    remote.get_library_count.return_value = 4
+    remote.create_model.side_effect = lambda item: item['Id']
+    return remote
+
+
+def test_compact_item():
+    item = dict(TRACKS[0], Path='/music/track.flac', MediaSources=[
+        {'Path': '/music/track.flac', 'MediaStreams': [
+            {'Type': 'Video'}, {'Type': 'Audio', 'BitRate': 320000}]}
+    ])
+
+    assert compact_item(item) == dict(TRACKS[0], MediaSources=[
+        {'MediaStreams': [{'Type': 'Audio', 'BitRate': 320000}]}])
+
+
+def test_full_sync(remote):
+    sync = LibrarySync(remote)
+    sync.sync()
+
+    assert sync.ready.is_set()
+    assert sync.artists() == [ARTIST]
+    assert sync.albums_by_artist('a1') == [ALBUM]
+    assert sync.tracks_in_album('b1') == TRACKS
+    remote.get_library_items.assert_called_with('lib')
+
+
+@mock.patch('mopidy_jellyfin.sync.invalidate_items')
+def test_delta_sync(invalidate_mock, remote):
+    sync = LibrarySync(remote)
+    sync.sync()
+
+    renamed = dict(TRACKS[0], Name='Renamed')
+    remote.get_library_items.return_value = [renamed]
+    remote.get_library_count.return_value = 3
+    remote.get_library_item_ids.return_value = {'b1', 't0', 't1'}
+    sync.sync()
+
+    remote.get_library_items.assert_called_with('lib', sync.last_sync)
+    assert sync.get('t0')['Name'] == 'Renamed'
+    assert sync.get('t2') is None
+    invalidate_mock.assert_called_once_with({'t0', 't2'}, aggregate=True)
+
+
+def test_restore(remote, tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    LibrarySync(remote, store=store).sync()
+
+    restored = LibrarySync(remote, store=store)
+    restored._restore()
+
+    assert restored.ready.is_set()
+    assert restored.tracks_by_artist('a1') == TRACKS
+    assert restored.last_sync is not None
+
+
+@mock.patch('mopidy_jellyfin.sync.invalidate_items')
+def test_queries_follow_changes(invalidate_mock, remote):
+    sync = LibrarySync(remote)
+    sync.sync()
+
+    moved = dict(TRACKS[0], AlbumId='b2', AlbumArtists=[],
+                 ArtistItems=[{'Id': 'a2', 'Name': 'Other'}])
+    remote.get_library_items.return_value = [moved]
+    remote.get_library_count.return_value = 3
+    remote.get_library_item_ids.return_value = {'b1', 't0', 't1'}
+    sync.sync()
+
+    assert sync.tracks_in_album('b1') == [TRACKS[1]]
+    assert sync.tracks_in_album('b2') == [moved]
+    assert sync.tracks_by_artist('a1') == [TRACKS[1]]
+    assert sync.tracks_by_artist('a2') == []
+    assert sync.tracks_by_artist('a2', album_artist=False) == [moved]
+    assert sync.albums_by_artist_name('Chairlift') == [ALBUM]
+
+
+def test_trigger_syncs_before_the_interval(remote):
+    synced = threading.Semaphore(0)
+    remote.get_library_ids.side_effect = lambda: synced.release() or ['lib']
+    sync = LibrarySync(remote, interval=0)
+    sync.start()
+
+    assert synced.acquire(timeout=5)
+    sync.trigger()
+    assert synced.acquire(timeout=5)
+    sync.stop()
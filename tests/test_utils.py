@@ -1,19 +1,26 @@
 from __future__ import unicode_literals
 
-from mock import Mock
+import random
+import threading
 
+from mock import Mock, patch
+
+import pytest
 
 from mopidy_jellyfin import utils
+from mopidy_jellyfin.store import MetadataStore
 
 
 def test_decorator():
-    func = Mock()
-    decorated_func = utils.cache()
-    decorated_func(func)
-    func()
+    func = Mock(__name__='func', return_value='ok')
+    decorated_func = utils.cache()(func)
+
+    assert decorated_func(1) == 'ok'
+    assert decorated_func(1) == 'ok'
 
-    assert func.called is True
-    assert decorated_func._call_count == 1
+    assert func.call_count == 1
+    assert decorated_func.cache.hits == 1
+    assert decorated_func.cache.misses == 1
 
 
 def test_set_default_cache():
@@ -23,13 +30,363 @@ def test_set_default_cache():
         return 'ok'
 
     assert returnstring() == 'ok'
+    assert utils.caches['returnstring'] is returnstring.cache
 
 
 def test_set_ttl_cache():
-    func = Mock()
-    decorated_func = utils.cache(func, ttl=5)
-    func()
+    func = Mock(__name__='func', return_value='ok')
+    decorated_func = utils.cache(ttl=5)(func)
+
+    with patch('mopidy_jellyfin.utils.time.time', return_value=100):
+        decorated_func()
+    with patch('mopidy_jellyfin.utils.time.time', return_value=104):
+        decorated_func()
+
+    assert func.call_count == 1
+    assert decorated_func.cache.ttl == 5
+
+    with patch('mopidy_jellyfin.utils.time.time', return_value=106):
+        decorated_func()
+
+    assert func.call_count == 2
+
+
+def test_lru_eviction():
+    lru = utils.LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+
+    assert 'a' in lru
+    assert 'b' not in lru
+    assert lru.evictions == 1
+
+
+def test_configure_caches():
+    @utils.cache(maxsize=10)
+    def configured(value):
+        return value
+
+    for i in range(10):
+        configured(i)
+
+    utils.configure_caches(
+        utils.parse_cache_sizes(['configured:4', 'broken']), 60)
+
+    assert len(configured.cache) == 4
+    assert configured.cache.ttl == 60
+
+
+def test_make_key_is_order_independent():
+    first = utils.make_key({'artist': ['a', 'b'], 'album': ['c']})
+    second = utils.make_key({'album': ['c'], 'artist': ['a', 'b']})
+
+    assert first == second
+    assert hash(first) == hash(second)
+    assert utils.make_key({'a': 1}) != utils.make_key((('a', 1),))
+
+
+def test_cache_dict_arguments():
+    func = Mock(__name__='func', return_value='ok')
+    decorated_func = utils.cache()(func)
+
+    decorated_func({'album': ['Moth']})
+    decorated_func({'album': ['Moth']})
+
+    assert func.call_count == 1
+
+
+def test_cache_key_function():
+    func = Mock(__name__='func', return_value='ok')
+    decorated_func = utils.cache(key=lambda item: item['Id'])(func)
+
+    decorated_func({'Id': 1, 'Name': 'foo'})
+    decorated_func({'Id': 1, 'Name': 'bar'})
+
+    assert func.call_count == 1
+
+
+def test_concurrent_misses_are_collapsed():
+    release = threading.Event()
+    calls = []
+
+    @utils.cache()
+    def slow_fetch(item_id):
+        calls.append(item_id)
+        release.wait(5)
+        return {'Id': item_id}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(slow_fetch('abc')))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    while slow_fetch.cache.collapsed < 3:
+        release.wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ['abc']
+    assert results == [{'Id': 'abc'}] * 4
+    assert slow_fetch.cache.stats()['collapsed'] == 3
+
+
+def test_failed_load_is_shared_and_not_cached():
+    func = Mock(__name__='func', side_effect=[Exception('down'), 'ok'])
+    decorated_func = utils.cache()(func)
+
+    with pytest.raises(Exception) as execinfo:
+        decorated_func()
+
+    assert 'down' in str(execinfo.value)
+
+    assert decorated_func() == 'ok'
+
+
+def test_persistent_cache(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    utils.configure_caches(store=store)
+    func = Mock(__name__='get_thing', return_value={'Id': 'abc'})
+    decorated_func = utils.cache(persist=True)(func)
+
+    assert decorated_func('self', 'abc') == {'Id': 'abc'}
+    decorated_func.cache.clear()
+    assert decorated_func('other', 'abc') == {'Id': 'abc'}
+
+    assert func.call_count == 1
+    assert store.get('get_thing', ['abc']) == {'Id': 'abc'}
+    utils.configure_caches()
+
+
+def test_prime_and_cached(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    utils.configure_caches(store=store)
+    func = Mock(__name__='get_other_thing')
+    decorated_func = utils.cache(persist=True)(func)
+
+    assert decorated_func.cached('self', 'abc') is None
+    decorated_func.prime({'Id': 'abc'}, 'self', 'abc')
+    assert decorated_func('self', 'abc') == {'Id': 'abc'}
+
+    decorated_func.cache.clear()
+    assert decorated_func.cached('self', 'abc') == {'Id': 'abc'}
+    assert not func.called
+    utils.configure_caches()
+
+
+def test_log_cache_stats(caplog):
+    decorated_func = utils.cache()(Mock(__name__='get_logged'))
+    decorated_func(1)
+    decorated_func(1)
+
+    with caplog.at_level('DEBUG', logger='mopidy_jellyfin.utils'):
+        utils.log_cache_stats()
+
+    assert 'Cache get_logged 1/128 entries, 1 hits, 1 misses' in caplog.text
+
+
+def test_invalidate_items():
+    @utils.cache()
+    def get_thing(item_id):
+        return {'Id': item_id}
+
+    @utils.cache(aggregate=True)
+    def get_listing(item_id):
+        return [item_id]
+
+    get_thing('abc')
+    get_thing('def')
+    get_listing('xyz')
+
+    utils.invalidate_items(['abc'])
+
+    assert len(get_thing.cache) == 1
+    assert len(get_listing.cache) == 1
+
+    utils.invalidate_items([], aggregate=True)
+
+    assert len(get_thing.cache) == 1
+    assert len(get_listing.cache) == 0
+
+
+def test_stale_while_revalidate():
+    func = Mock(__name__='func', side_effect=['old', 'new'])
+    decorated_func = utils.cache(ttl=10, max_stale=60)(func)
+
+    with patch('mopidy_jellyfin.utils.time.time', return_value=100):
+        assert decorated_func() == 'old'
+    with patch('mopidy_jellyfin.utils.time.time', return_value=120):
+        assert decorated_func() == 'old'
+        utils._refresher.shutdown(wait=True)
+        utils._refresher = None
+        assert decorated_func() == 'new'
+
+    assert func.call_count == 2
+    assert decorated_func.cache.stale_hits == 1
+
+
+def test_refresh_does_not_use_stale_nested_entries():
+    inner = utils.cache(ttl=10, max_stale=60)(
+        Mock(__name__='inner', side_effect=['v1', 'v2']))
+    outer = utils.cache(ttl=10, max_stale=60)(
+        Mock(__name__='outer', side_effect=lambda: inner()))
+
+    with patch('mopidy_jellyfin.utils.time.time', return_value=100):
+        assert outer() == 'v1'
+    with patch('mopidy_jellyfin.utils.time.time', return_value=150):
+        assert outer() == 'v1'
+        utils._refresher.shutdown(wait=True)
+        utils._refresher = None
+        assert outer() == 'v2'
+
+
+def test_bind_refresh_carries_the_refresh_state():
+    utils._refreshing.active = True
+    try:
+        check = utils.bind_refresh(utils._in_refresh)
+    finally:
+        utils._refreshing.active = False
+    results = []
+    thread = threading.Thread(target=lambda: results.append(check()))
+    thread.start()
+    thread.join()
+
+    assert results == [True]
+    assert not utils._in_refresh()
+
+
+def test_stale_entries_have_a_limit():
+    func = Mock(__name__='func', side_effect=['old', 'new'])
+    decorated_func = utils.cache(ttl=10, max_stale=60)(func)
+
+    with patch('mopidy_jellyfin.utils.time.time', return_value=100):
+        decorated_func()
+    with patch('mopidy_jellyfin.utils.time.time', return_value=200):
+        assert decorated_func() == 'new'
+
+
+def test_stale_persistent_entries_are_refreshed_from_the_server(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    utils.configure_caches(store=store)
+    func = Mock(__name__='get_stale', side_effect=['old', 'new'])
+    decorated_func = utils.cache(ttl=10, max_stale=60, persist=True)(func)
+
+    with patch('mopidy_jellyfin.utils.time.time', return_value=100):
+        assert decorated_func('self', 'abc') == 'old'
+    with patch('mopidy_jellyfin.utils.time.time', return_value=115):
+        store.set('get_stale', ['abc'], 'saved')
+    with patch('mopidy_jellyfin.utils.time.time', return_value=120):
+        assert decorated_func('self', 'abc') == 'old'
+        utils._refresher.shutdown(wait=True)
+        utils._refresher = None
+        assert decorated_func('self', 'abc') == 'new'
+        assert store.get('get_stale', ['abc']) == 'new'
+
+    assert func.call_count == 2
+    utils.configure_caches()
+
+
+def test_expired_saved_results_are_served_while_refreshed(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    # Saved before a restart, two hours ago
+    with patch('mopidy_jellyfin.store.time.time', return_value=100):
+        store.set('get_restarted', ['abc'], 'old')
+    utils.configure_caches(store=store)
+    func = Mock(__name__='get_restarted', return_value='new')
+    decorated_func = utils.cache(
+        ttl=3600, max_stale=86400, persist=True)(func)
+
+    with patch('mopidy_jellyfin.utils.time.time', return_value=7300):
+        assert decorated_func('self', 'abc') == 'old'
+        utils._refresher.shutdown(wait=True)
+        utils._refresher = None
+        assert decorated_func('self', 'abc') == 'new'
+
+    assert func.call_count == 1
+    assert decorated_func.cache.stale_hits == 1
+    utils.configure_caches()
+
+
+def test_failed_call_falls_back_to_saved_result(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    # Saved long before the cache's ttl
+    with patch('mopidy_jellyfin.store.time.time', return_value=100):
+        store.set('get_saved', ['abc'], {'Id': 'abc'})
+    utils.configure_caches(store=store)
+    func = Mock(__name__='get_saved', side_effect=Exception('timeout'))
+    decorated_func = utils.cache(persist=True)(func)
+
+    assert decorated_func('self', 'abc') == {'Id': 'abc'}
+    assert decorated_func.cache._data[('self', 'abc')][1] <= (
+        utils.time.time() + utils.FALLBACK_TTL)
+
+    with pytest.raises(Exception):
+        decorated_func('self', 'def')
+    utils.configure_caches()
+
+
+def test_saved_results_follow_the_cache_ttl(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    utils.configure_caches(store=store)
+    func = Mock(__name__='get_fresh', side_effect=['old', 'new', 'newer'])
+    decorated_func = utils.cache(ttl=10, persist=True)(func)
+
+    with patch('mopidy_jellyfin.utils.time.time', return_value=100):
+        assert decorated_func('self', 'abc') == 'old'
+    # Expired in memory, the saved copy is just as old
+    with patch('mopidy_jellyfin.utils.time.time', return_value=120):
+        assert decorated_func('self', 'abc') == 'new'
+
+    # After a restart the saved copy is only used for the rest of its ttl
+    decorated_func.cache.clear()
+    with patch('mopidy_jellyfin.utils.time.time', return_value=125):
+        assert decorated_func('self', 'abc') == 'new'
+    with patch('mopidy_jellyfin.utils.time.time', return_value=131):
+        assert decorated_func('self', 'abc') == 'newer'
+
+    assert func.call_count == 3
+    utils.configure_caches()
+
+
+def apply_edits(curr_ids, removed, added, moves):
+    # Replays the edits the way the server applies them
+    entries = [
+        item_id for index, item_id in enumerate(curr_ids)
+        if index not in removed] + added
+    positions = list(range(len(entries)))
+    for position, new_index in moves:
+        old_index = positions.index(position)
+        positions.insert(new_index, positions.pop(old_index))
+    return [entries[position] for position in positions]
+
+
+@pytest.mark.parametrize('curr_ids,new_ids,counts', [
+    ('abcd', 'abcd', (0, 0, 0)),
+    ('abcd', 'dabc', (0, 0, 1)),
+    ('abcd', 'badc', (0, 0, 2)),
+    ('abcd', 'xdcay', (1, 2, 3)),
+    ('aabca', 'abaa', (1, 0, 1)),
+    ('', 'ab', (0, 2, 0)),
+    ('ab', '', (2, 0, 0)),
+])
+def test_playlist_edits(curr_ids, new_ids, counts):
+    removed, added, moves = utils.playlist_edits(list(curr_ids), list(new_ids))
+
+    assert (len(removed), len(added), len(moves)) == counts
+    assert apply_edits(list(curr_ids), removed, added, moves) == list(new_ids)
+
+
+def test_playlist_edits_shuffled():
+    rng = random.Random(4)
+    curr_ids = [str(i % 40) for i in range(200)]
+    new_ids = rng.sample(curr_ids, 150) + ['new1', 'new2']
+
+    removed, added, moves = utils.playlist_edits(curr_ids, new_ids)
 
-    assert func.called is True
-    assert decorated_func._call_count == 1
-    assert decorated_func.ttl == 5
+    assert len(removed) == 50
+    assert added == ['new1', 'new2']
+    assert apply_edits(curr_ids, removed, added, moves) == new_ids